@@ -4,190 +4,337 @@
 
 import asyncio
 import logging
-import socket
-import struct
-import binascii
-import zlib
 import json
-from itertools import cycle
-from homeassistant.core import HomeAssistant
+import time
+from homeassistant.core import HomeAssistant, ServiceCall, SupportsResponse, callback
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import CONF_DEVICE, CONF_PASSWORD, CONF_MODE
+from homeassistant.components.network import async_get_source_ip
+from homeassistant.const import CONF_DEVICE, CONF_PASSWORD, CONF_MODE, CONF_HOST
+from homeassistant.exceptions import HomeAssistantError
 import homeassistant.helpers.config_validation as cv
+from homeassistant.helpers.storage import Store
+from homeassistant.util import dt as dt_util
 import voluptuous as vol
-from .const import DOMAIN, EVENT_NEW_DATA, UDP_GROUP, UDP_PORT
+from .const import (
+    DOMAIN,
+    CONF_COMMAND_WINDOW,
+    CONF_INTERFACES,
+    CONF_JOURNAL,
+    CONF_STALE_TIMEOUT,
+    CONF_TRANSPORT,
+    DEFAULT_COMMAND_WINDOW,
+    DEFAULT_STALE_TIMEOUT,
+    STORAGE_KEY,
+    STORAGE_VERSION,
+    TRANSPORT_MULTICAST,
+    TRANSPORT_UNICAST,
+)
+from .history import HISTORY_KEYS, RESOLUTIONS
+from .hub import AirtubDevice, AirtubListener
+from .profiler import HotPathProfiler
 
 _LOGGER = logging.getLogger(__name__)
 
-MSG_TYPE = 4
 ATTR_JSON_DATA = "cmd"
 SERVICE_RECEIVE_JSON = "sender"
 SERVICE_RECEIVE_JSON_SCHEMA = vol.Schema(
     {
         vol.Required(ATTR_JSON_DATA): cv.string,
+        vol.Optional(CONF_DEVICE): cv.string,
     }
 )
 
-RETRY_MAX = 5
-MSG_RECEIVED = False
-SOCK = None
-
-
-def xor_crypt(a: str, b: str):
-    """XOR encode/decode."""
-    return "".join(chr(ord(x) ^ ord(y)) for x, y in zip(a, cycle(b)))
-
-
-def pack_data(msgtype: int, message: str, secret: str):
-    """Encode data to send over UDP."""
-    len_num = len(message)
-    crypt_data = xor_crypt(message, secret).encode("ascii")
-    crc = zlib.crc32(crypt_data).to_bytes(4, "little")
-
-    # Simplified bytearray creation using struct.pack
-    send_data = bytearray(struct.pack("BB2x", msgtype, len_num))
-    send_data.extend(crc)
-    send_data.extend(crypt_data)
-    # send_data.extend(bytearray(180 - len_num))
-
-    return bytes(send_data)
-
-
-def unpack_data(data: bytes, secret: str):
-    """Decode data received from UDP."""
-    if len(data) != 0:
-        msgtype, datalen = struct.unpack("BB2x", data[:4])
-        crc1 = binascii.hexlify(data[4:8][::-1]).decode()
-        realdata = data[8 : datalen + 8]
-        crc2 = hex(zlib.crc32(realdata))[2:]
-        realdata = xor_crypt(realdata.decode("ascii"), secret).encode("ascii")
-        return msgtype, datalen, realdata, crc1, crc2
-    return 0, 0, b"", "", ""
-
-
-async def udp_listener(
-    hass: HomeAssistant,
-    multicast_group: str,
-    multicast_port: int,
-    secret: str,
-    device: str,
-):
-    """Listen for UDP multicast messages."""
-    global MSG_RECEIVED, SOCK
-    SOCK = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-    SOCK.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    SOCK.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-    SOCK.bind(("0.0.0.0", multicast_port))
-    mreq = struct.pack("=4sl", socket.inet_aton(multicast_group), socket.INADDR_ANY)
-    SOCK.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-    SOCK.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 10)
-    SOCK.setblocking(False)
+ATTR_KEY = "key"
+ATTR_RESOLUTION = "resolution"
+SERVICE_HISTORY = "history"
+SERVICE_HISTORY_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_KEY): vol.In(HISTORY_KEYS),
+        vol.Optional(ATTR_RESOLUTION, default="1m"): vol.In(RESOLUTIONS),
+        vol.Optional(CONF_DEVICE): cv.string,
+    }
+)
 
-    loop = asyncio.get_running_loop()
-    hass.states.async_set(f"{DOMAIN}.status", "waiting for data")
+ATTR_DURATION = "duration"
+SERVICE_PROFILE = "profile"
+SERVICE_PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_DURATION, default=30): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=600)
+        ),
+    }
+)
 
+PLATFORMS = ["sensor", "climate"]
+
+MODE_CHECK_INTERVAL = 5
+MODE_RECONCILE_INTERVAL = 60
+UNICAST_RETRY_INTERVAL = 30
+UNICAST_RESTORE_TIMEOUT = 10
+WATCHDOG_INTERVAL = 5
+
+
+async def async_reconcile_mode(device: AirtubDevice, desired: int):
+    """Bring the device's operating mode (atm) in line with the configured one.
+
+    Runs in the background until the device reports the configured mode once,
+    sending at most one correction per MODE_RECONCILE_INTERVAL. After that the
+    user is free to change atm, e.g. turning CH off in automatic mode.
+    """
+    loop = asyncio.get_running_loop()
+    last_sent = None
     while True:
-        try:
-            data, addr = await loop.sock_recvfrom(SOCK, 1024)
-            if data:
-                dataid, datalen, realdata, crc1, crc2 = unpack_data(data, secret)
-                if crc1 == crc2 and device in realdata.decode("ascii", errors="ignore"):
-                    data_content = realdata.decode("ascii", errors="ignore").replace(
-                        f'"dev":"{device}",', ""
-                    )
-                    hass.data[DOMAIN]["ip"] = addr[0] if hass.data[DOMAIN].get("ip") != addr[0] else hass.data[DOMAIN]["ip"]
-                    data_dict = json.loads(data_content)
-                    if "rec" in data_dict:
-                        MSG_RECEIVED = True
-                        del data_dict["rec"]
-                        hass.states.async_set(f"{DOMAIN}.status", "ready")
-                    data_dict.setdefault("mod", 0)
-                    data_dict.setdefault("flt", 0)
-                    data_dict.setdefault("pwr", 0)
-                    data_dict.setdefault("sch", 0)
-                    data_dict.setdefault("tmd", 0)
-                    data_dict.setdefault("tol", 4)
-                    if "gas" in data_dict and data_dict["gas"] == 0:
-                        data_dict["gas"] = 0.000001
-
-                    hass.data[DOMAIN]["data"] = data_dict
-                    if "crt" in data_dict:
-                        hass.bus.async_fire(EVENT_NEW_DATA)
-        except socket.error as e:
-            _LOGGER.error("Socket error: %s", e)
-            await asyncio.sleep(1)  # Wait a bit before retrying in case of error
-        await asyncio.sleep(0)  # Yield control to the event loop
+        # 点对点模式下 ip 预先设为配置的地址，以收到数据为准
+        if device.last_heard is not None:
+            reported = device.telemetry.get("atm")
+            if reported == desired:
+                return
+            now = loop.time()
+            if reported is not None and (
+                last_sent is None or now - last_sent >= MODE_RECONCILE_INTERVAL
+            ):
+                last_sent = now
+                _LOGGER.info("AIRTUB: Correcting operating mode %s -> %s", reported, desired)
+                device.coalescer.async_queue({"atm": desired})
+        await asyncio.sleep(MODE_CHECK_INTERVAL)
+
+
+async def async_ensure_unicast(device: AirtubDevice, local_ip: str):
+    """Switch the device to point-to-point UDP towards this host with "ser".
+
+    The command is repeated until the first frame arrives on the unicast
+    listener, as its ack may still go out over multicast.
+    """
+    while device.last_heard is None:
+        _LOGGER.info("AIRTUB: Asking %s to send to %s", device.device, local_ip)
+        device.coalescer.async_queue({"ser": local_ip})
+        await asyncio.sleep(UNICAST_RETRY_INTERVAL)
+
+
+async def async_watchdog(device: AirtubDevice, timeout: float):
+    """Recover a device that stopped sending and flag its entities.
+
+    Once the device has been silent for several report intervals, and its
+    listener's socket has received nothing for as long, the listener renews
+    the multicast membership, then rebuilds the socket with backoff. A
+    unicast device is then also asked again to send to this host. A device
+    that is silent while others on the socket are heard is only flagged.
+    After timeout seconds of silence the entities become unavailable. The
+    time until the next frame is recorded as the recovery time.
+    """
+    started = time.monotonic()
+    while True:
+        await asyncio.sleep(WATCHDOG_INTERVAL)
+        last_heard = device.last_heard or started
+        now = time.monotonic()
+        if now - last_heard < device.stale_after:
+            continue
+        if device.stale_since is None:
+            device.stale_since = last_heard
+            _LOGGER.warning(
+                "AIRTUB: No data from %s for %.0f s", device.device, now - last_heard
+            )
+        listener = device.listener
+        if listener.recover(device.stale_after) and not listener.multicast:
+            device.coalescer.async_queue({"ser": listener.bind_ip})
+        if now - last_heard >= timeout:
+            device.set_available(False)
+
+
+def _isoformat(timestamp: float) -> str:
+    """Format a history timestamp for a service response."""
+    return dt_util.utc_from_timestamp(timestamp).isoformat()
+
+
+@callback
+def _attach_profiler(listeners, profiler):
+    """Route the listeners' and their senders' hot paths through a profiler."""
+    for listener in listeners:
+        listener.profiler = profiler
+        for device in listener.devices.values():
+            device.sender.profiler = profiler
+
+
+@callback
+def _get_device(hass: HomeAssistant, serial):
+    """Return the device a service call targets."""
+    devices = {
+        key: device
+        for listener in hass.data[DOMAIN]["listeners"].values()
+        for key, device in listener.devices.items()
+    }
+    if serial:
+        return devices.get(serial.lower())
+    if len(devices) == 1:
+        return next(iter(devices.values()))
+    return None
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up Airtub UDP from a config entry."""
-    multicast_group = UDP_GROUP
-    multicast_port = UDP_PORT
-    device = entry.data.get(CONF_DEVICE).lower()
-    secret = entry.data.get(CONF_PASSWORD)
+    serial = entry.data.get(CONF_DEVICE).lower()
     mode = entry.options.get(CONF_MODE, entry.data.get(CONF_MODE, "auto"))
+    transport = entry.options.get(
+        CONF_TRANSPORT, entry.data.get(CONF_TRANSPORT, TRANSPORT_MULTICAST)
+    )
+    host = entry.options.get(CONF_HOST, entry.data.get(CONF_HOST)) or None
 
     async def handle_json_service(call):
         json_data = call.data.get(ATTR_JSON_DATA)
-        remote_ip = hass.data[DOMAIN].get("ip")
-        if remote_ip is None:
-            return True
+        device = _get_device(hass, call.data.get(CONF_DEVICE))
+        if device is None:
+            _LOGGER.error("AIRTUB: Please specify which device to send the command to")
+            return
         try:
             parsed_data = json.loads(json_data)
-            parsed_data.update({"tar": device, "dev": DOMAIN, "pwr": 5})
-
-            hass.states.async_set(f"{DOMAIN}.status", "busy")
-            loop = asyncio.get_running_loop()
-            retry = 0
-            MSG_RECEIVED = False
-            while not MSG_RECEIVED and retry < RETRY_MAX:
-                parsed_data["try"] = retry
-                retry += 1
-                encrypted_data = pack_data(
-                    MSG_TYPE, json.dumps(parsed_data, separators=(",", ":")), secret
-                )
-                await asyncio.sleep(1)  # 延时1秒
-                await loop.sock_sendto(SOCK, encrypted_data, (remote_ip, multicast_port))
-            hass.states.async_set(f"{DOMAIN}.status", "ready")
-        except (OSError, socket.gaierror) as e:
-            _LOGGER.error("AIRTUB: Error occurred while sending data: %s", e)
         except json.JSONDecodeError as e:
             _LOGGER.warning("AIRTUB: Error decoding JSON: %s", e)
-            hass.states.async_set(f"{DOMAIN}.status", "error")
-
-    async def handle_data_received_event(event):
-        """Handle the event when data is received."""
+            device.set_status("error")
+            return
+        await device.async_send_command(parsed_data)
+
+    @callback
+    def handle_history_service(call: ServiceCall):
+        """Return the recent history of a key from memory."""
+        device = _get_device(hass, call.data.get(CONF_DEVICE))
+        if device is None:
+            raise HomeAssistantError("Please specify which Airtub device to read")
+        key = call.data[ATTR_KEY]
+        resolution = call.data[ATTR_RESOLUTION]
+        history = device.history.keys[key]
+        if resolution == "raw":
+            samples = [
+                {"time": _isoformat(timestamp), "value": value}
+                for timestamp, value in history.raw.samples()
+            ]
+        else:
+            samples = [
+                {"start": _isoformat(start), "min": low, "max": high, "mean": round(mean, 3)}
+                for start, low, high, mean in history.rollups[resolution].buckets()
+            ]
+        return {
+            "device": device.device,
+            "key": key,
+            "resolution": resolution,
+            "samples": samples,
+        }
+
+    async def handle_profile_service(call: ServiceCall):
+        """Profile the receive, dispatch and send paths for a number of seconds."""
+        domain_data = hass.data[DOMAIN]
+        if domain_data.get("profiler") is not None:
+            raise HomeAssistantError("An Airtub profile is already running")
+        profiler = HotPathProfiler()
+        try:
+            # 其他分析工具正在运行时 cProfile 无法启用
+            profiler.profile.enable()
+            profiler.profile.disable()
+        except ValueError as e:
+            raise HomeAssistantError(f"Cannot start the profiler: {e}") from e
+        domain_data["profiler"] = profiler
+        listeners = list(domain_data["listeners"].values())
+        _attach_profiler(listeners, profiler)
         try:
-            await hass.config_entries.async_forward_entry_setups(entry, ["sensor", "climate"])
+            await asyncio.sleep(call.data[ATTR_DURATION])
+        finally:
+            _attach_profiler(listeners, None)
+            domain_data.pop("profiler", None)
+        base = hass.config.path(f"{DOMAIN}_profile_{dt_util.now():%Y%m%d_%H%M%S}")
+        prof_path, text_path = await hass.async_add_executor_job(profiler.write, base)
+        _LOGGER.info("AIRTUB: Profile written to %s and %s", prof_path, text_path)
+        return {"profile": prof_path, "summary": text_path, "calls": profiler.calls}
+
+    async def async_forward(status=None):
+        """Load the sensor and climate platforms."""
+        try:
+            await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
         except Exception as e:
             _LOGGER.error("Error setting up platforms: %s", e)
-        hass.states.async_set(f"{DOMAIN}.status", "ready")
+        if status is not None:
+            device.set_status(status)
+
+    @callback
+    def handle_first_data():
+        """Load the platforms once the first complete frame has arrived."""
+        entry.async_create_task(hass, async_forward("ready"))
 
     try:
-        hass.data.setdefault(DOMAIN, {})
-        hass.data[DOMAIN].update({
-            "device": device,
-            "mode": mode,
-            "ip": None,
-            "data": {
-                "sch":0, "loc":0, "tmd":0, "tol":0, "tcm":0, "tct":0,
-                "tdm":0, "tdt":0, "atm":0, "trt":0, "crt":0, "pwr":0,
-                "odt":0 ,"coe":0 ,"ccm":0, "cct":0, "cdm":0, "cdt":0,
-                "fst":0,"ovr":0,"gas":0.000001
-            }
-        })
-
-        udp_listen_task = hass.loop.create_task(
-            udp_listener(hass, multicast_group, multicast_port, secret, device)
+        domain_data = hass.data.setdefault(DOMAIN, {})
+        device = AirtubDevice(
+            hass,
+            serial,
+            entry.data.get(CONF_PASSWORD),
+            mode,
+            entry.options.get(CONF_COMMAND_WINDOW, DEFAULT_COMMAND_WINDOW),
+            handle_first_data,
+            host,
+            entry.options.get(CONF_JOURNAL, False),
+            entry.options.get(CONF_INTERFACES, ()) if transport == TRANSPORT_MULTICAST else (),
         )
-        hass.data[DOMAIN]["udp_listen_task"] = udp_listen_task
-
-        hass.services.async_register(
-            DOMAIN, SERVICE_RECEIVE_JSON, handle_json_service, schema=SERVICE_RECEIVE_JSON_SCHEMA
+        # 先加载缓存，再开始接收数据，避免实时数据被旧缓存覆盖
+        restored = await device.async_restore()
+
+        # 组播设备共用同一个组播监听，点对点设备共用绑定在本机地址上的监听
+        bind_ip = "0.0.0.0"
+        if transport == TRANSPORT_UNICAST:
+            if host is None:
+                _LOGGER.error("AIRTUB: Unicast mode needs the device IP address")
+                return False
+            bind_ip = await async_get_source_ip(hass, target_ip=host)
+        listeners = domain_data.setdefault("listeners", {})
+        listener = listeners.get(bind_ip)
+        if listener is None:
+            listener = AirtubListener(
+                hass, bind_ip, multicast=transport == TRANSPORT_MULTICAST
+            )
+            await listener.async_start()
+            listeners[bind_ip] = listener
+        listener.add(device)
+        domain_data[entry.entry_id] = device
+        device.set_status("waiting for data")
+        # 有缓存数据时立即加载实体，收到实时数据前标记为过期
+        if restored:
+            entry.async_create_task(hass, async_forward())
+
+        entry.async_create_background_task(
+            hass,
+            async_reconcile_mode(device, 1 if mode == "auto" else 0),
+            f"{DOMAIN}_{serial}_reconcile_mode",
+        )
+        if transport == TRANSPORT_UNICAST:
+            entry.async_create_background_task(
+                hass,
+                async_ensure_unicast(device, bind_ip),
+                f"{DOMAIN}_{serial}_ensure_unicast",
+            )
+        entry.async_create_background_task(
+            hass,
+            async_watchdog(
+                device, entry.options.get(CONF_STALE_TIMEOUT, DEFAULT_STALE_TIMEOUT)
+            ),
+            f"{DOMAIN}_{serial}_watchdog",
         )
 
-        # Register the event listener
-        hass.bus.async_listen_once(EVENT_NEW_DATA, handle_data_received_event)
+        if not hass.services.has_service(DOMAIN, SERVICE_RECEIVE_JSON):
+            hass.services.async_register(
+                DOMAIN, SERVICE_RECEIVE_JSON, handle_json_service, schema=SERVICE_RECEIVE_JSON_SCHEMA
+            )
+        if not hass.services.has_service(DOMAIN, SERVICE_HISTORY):
+            hass.services.async_register(
+                DOMAIN,
+                SERVICE_HISTORY,
+                handle_history_service,
+                schema=SERVICE_HISTORY_SCHEMA,
+                supports_response=SupportsResponse.ONLY,
+            )
+        if not hass.services.has_service(DOMAIN, SERVICE_PROFILE):
+            hass.services.async_register(
+                DOMAIN,
+                SERVICE_PROFILE,
+                handle_profile_service,
+                schema=SERVICE_PROFILE_SCHEMA,
+                supports_response=SupportsResponse.OPTIONAL,
+            )
 
     except Exception as e:
         _LOGGER.error("Error during setup: %s", e)
@@ -199,26 +346,43 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 async def async_unload_entry(hass, entry):
     """Unload Airtub UDP config entry."""
 
-    udp_listen_task = hass.data[DOMAIN].get("udp_listen_task")
-    if udp_listen_task is not None:
-        udp_listen_task.cancel()  # 取消任务
-        try:
-            await udp_listen_task  # 确保任务完全取消
-        except asyncio.CancelledError:
-            _LOGGER.info("UDP listener task has been cancelled.")
-
-    hass.services.async_remove(DOMAIN, SERVICE_RECEIVE_JSON)
-
-    entity_id = f"{DOMAIN}.status"
-    if hass.states.get(entity_id):
-        hass.states.async_remove(entity_id)
-
-    unload_ok = await hass.config_entries.async_unload_platforms(
-        entry, ["climate", "sensor"]
-    )
+    unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
 
     # If all platforms were successfully unloaded, remove the entry data.
     if unload_ok:
-        hass.data.pop(DOMAIN, None)
+        domain_data = hass.data[DOMAIN]
+        device = domain_data.pop(entry.entry_id)
+        listener = device.listener
+        if not listener.multicast:
+            # 恢复设备的组播模式，避免设备继续发送到不再监听的地址
+            try:
+                await asyncio.wait_for(
+                    device.async_send_command({"ser": "0.0.0.0"}), UNICAST_RESTORE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                _LOGGER.warning("AIRTUB: Could not switch %s back to multicast", device.device)
+        device.coalescer.cancel()
+        if device.last_heard is not None:
+            await device.store.async_save(device.snapshot())
+        if hass.states.get(device.status_entity_id):
+            hass.states.async_remove(device.status_entity_id)
+
+        # 只有最后一个设备卸载时才关闭共用的监听
+        if listener.remove(device):
+            listener.close()  # 关闭套接字
+            _LOGGER.info("UDP listener transport has been closed.")
+            del domain_data["listeners"][listener.bind_ip]
+        if not domain_data["listeners"]:
+            hass.services.async_remove(DOMAIN, SERVICE_RECEIVE_JSON)
+            hass.services.async_remove(DOMAIN, SERVICE_HISTORY)
+            hass.services.async_remove(DOMAIN, SERVICE_PROFILE)
+            hass.data.pop(DOMAIN, None)
 
     return unload_ok
+
+
+async def async_remove_entry(hass, entry):
+    """Delete the cached data of a removed device."""
+    await Store(
+        hass, STORAGE_VERSION, STORAGE_KEY.format(entry.data.get(CONF_DEVICE).lower())
+    ).async_remove()
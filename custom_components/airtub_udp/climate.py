@@ -3,262 +3,252 @@
 # pylint: disable=broad-except, global-statement, too-many-locals, too-many-statements, unused-argument, unused-variable, import-error, abstract-method
 
 import logging
-import asyncio
+from functools import partial
 from homeassistant.components.climate import ClimateEntity
 from homeassistant.components.climate.const import HVACMode, ClimateEntityFeature
 from homeassistant.const import UnitOfTemperature, ATTR_TEMPERATURE
-from .const import DOMAIN, EVENT_NEW_DATA
+from homeassistant.core import callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.event import async_call_later
+from .const import DOMAIN, SIGNAL_AVAILABLE, SIGNAL_LIVE, SIGNAL_UPDATE
+from .telemetry import FIELD_INDEX
 
 _LOGGER = logging.getLogger(__name__)
 
+# 等待设备上报目标值的最长时间（秒），超时后回退到设备上报的值
+PENDING_TIMEOUT = 30
 
-async def async_setup_entry(hass, config_entry, async_add_entities):
-    """Set up the climate platform from a config entry."""
-    device = hass.data[DOMAIN].get("device")
-    if not device:
-        return
-
-    operate = hass.data[DOMAIN].get("mode", "auto")
-    op_mode = 1 if operate == "auto" else 0
-
-    devices = [
-        AirtubClimateDevice(hass, f"boiler_{device}_ch", op_mode),
-        AirtubClimateDevice(hass, f"boiler_{device}_dhw", op_mode)
-    ]
-    async_add_entities(devices)
+FST = FIELD_INDEX["fst"]
+IDLE = "待机"
+HEATING = "🔥加热中"
 
-    async def handle_new_data_event(event):
-        await asyncio.gather(*(device.async_update() for device in devices))
-        for device in devices:
-            device.async_schedule_update_ha_state(True)
 
-    hass.bus.async_listen(EVENT_NEW_DATA, handle_new_data_event)
+async def async_setup_entry(hass, config_entry, async_add_entities):
+    """Set up the climate platform from a config entry."""
+    airtub = hass.data[DOMAIN][config_entry.entry_id]
+    heating = AirtubChAutoClimate if airtub.mode == "auto" else AirtubChManualClimate
+    async_add_entities([heating(hass, airtub), AirtubDhwClimate(hass, airtub)])
 
 
 class AirtubClimateDevice(ClimateEntity):
-    """Representation of a custom climate device."""
-
-    def __init__(self, hass, name, mode):
+    """Boiler circuit bound to a fixed set of telemetry keys.
+
+    Subclasses name the keys of the on/off switch, the current and target
+    temperature and the demand flag. Their record indices are resolved once.
+    """
+
+    _attr_should_poll = False
+    _attr_has_entity_name = True
+    _attr_temperature_unit = UnitOfTemperature.CELSIUS
+    _attr_hvac_modes = [HVACMode.OFF, HVACMode.HEAT]
+    _attr_target_temperature_step = 1.0
+    _attr_supported_features = (
+        ClimateEntityFeature.TARGET_TEMPERATURE
+        | ClimateEntityFeature.TURN_ON
+        | ClimateEntityFeature.TURN_OFF
+    )
+    _enable_turn_on_off_backwards_compatibility = False
+
+    circuit = None
+    switch_key = None
+    current_key = None
+    target_key = None
+    demand_key = None
+
+    def __init__(self, hass, airtub):
         """Initialize the climate device."""
-        self._enable_turn_on_off_backwards_compatibility = False
-        self._mode = mode
-        self._unique_id = name
-        self.entity_id = f"climate.{name}"
-        self._name = self._generate_friendly_name()
         self._hass = hass
-        self._mode_set = False
-        self._attr_icon_ch = "mdi:radiator"
-        self._attr_icon_dhw = "mdi:shower"
-        self._temperature = 0
-        self._target_temperature = 0
-        self._hvac_mode = HVACMode.OFF
-        self._operation = "待机"
-        self._man_temperature = 0
-        self._man_target_temperature = 0
-        self._man_hvac_mode = HVACMode.OFF
-        self._dhw_temperature = 0
-        self._dhw_target_temperature = 0
-        self._dhw_mode = HVACMode.OFF
-        self._dhw_operation = "待机"
-        self._supported_features = (
-            ClimateEntityFeature.TARGET_TEMPERATURE
-            | ClimateEntityFeature.TURN_ON
-            | ClimateEntityFeature.TURN_OFF
+        self._airtub = airtub
+        self._device = airtub.device
+        self._attr_unique_id = f"boiler_{airtub.device}_{self.circuit}"
+        self.entity_id = f"climate.boiler_{airtub.device}_{self.circuit}"
+        self._switch = FIELD_INDEX[self.switch_key]
+        self._current = FIELD_INDEX[self.current_key]
+        self._target = FIELD_INDEX[self.target_key]
+        self._demand = FIELD_INDEX[self.demand_key]
+        self._attr_hvac_mode = HVACMode.OFF
+        self._attr_hvac_action = IDLE
+        self._attr_current_temperature = 0
+        self._attr_target_temperature = 0
+        self._update_scheduled = False
+        # 待确认的命令：键 -> (目标值, 取消超时回调)
+        self._pending = {}
+
+    async def async_added_to_hass(self):
+        """Subscribe to changes of the keys this entity depends on."""
+        for key in (self.switch_key, self.current_key, self.target_key, self.demand_key, "fst"):
+            self.async_on_remove(
+                async_dispatcher_connect(
+                    self.hass, SIGNAL_UPDATE.format(self._device, key), self.handle_update
+                )
+            )
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, SIGNAL_AVAILABLE.format(self._device), self.handle_update
+            )
         )
-        self._disable_update = False
-
-    def _generate_friendly_name(self):
-        """Generate a friendly name."""
-        if "_ch" in self._unique_id:
-            return "ch_auto_control" if self._mode else "ch_man_control"
-        return "dhw_control"
-
-    @property
-    def unique_id(self):
-        """Return the unique ID of the climate device."""
-        return self._unique_id
-
-    @property
-    def translation_key(self):
-        """Return the translation key."""
-        return self._name
-
-    @property
-    def has_entity_name(self):
-        """Return the entity name."""
-        return True
-
-    @property
-    def icon(self):
-        return self._attr_icon_ch if "_ch" in self._unique_id else self._attr_icon_dhw
-
-    @property
-    def temperature_unit(self):
-        """Return the unit of measurement."""
-        return UnitOfTemperature.CELSIUS
-
-    @property
-    def hvac_modes(self):
-        """Return the list of available operation modes."""
-        return [HVACMode.OFF, HVACMode.HEAT]
-
-    @property
-    def supported_features(self):
-        """Return the list of supported features."""
-        return self._supported_features
-
-    @property
-    def hvac_mode(self):
-        """Return current operation mode."""
-        if "_ch" in self._unique_id:
-            return self._hvac_mode if self._mode else self._man_hvac_mode
-        return self._dhw_mode
-
-    @property
-    def target_temperature_step(self):
-        """Return the supported step of target temperature."""
-        return 1.0  # 设置步进为1.0
-
-    @property
-    def target_temperature(self):
-        """Return the temperature we try to reach."""
-        if "_ch" in self._unique_id:
-            return self._target_temperature if self._mode else self._man_target_temperature
-        return self._dhw_target_temperature
+        if self._airtub.stale:
+            self.async_on_remove(
+                async_dispatcher_connect(
+                    self.hass, SIGNAL_LIVE.format(self._device), self.handle_update
+                )
+            )
+        self.async_schedule_update_ha_state(True)
+
+    async def async_will_remove_from_hass(self):
+        """Cancel the timeouts of pending commands."""
+        for key in list(self._pending):
+            self._cancel_pending(key)
+
+    @callback
+    def handle_update(self, value=None):
+        """Refresh once per frame, however many watched keys changed."""
+        if self._update_scheduled:
+            return
+        self._update_scheduled = True
+        self.hass.loop.call_soon(self._scheduled_update)
 
-    @property
-    def current_temperature(self):
-        """Return the current temperature."""
-        if "_ch" in self._unique_id:
-            return self._temperature if self._mode else self._man_temperature
-        return self._dhw_temperature
+    @callback
+    def _scheduled_update(self):
+        """Run the update scheduled by handle_update."""
+        self._update_scheduled = False
+        self.async_schedule_update_ha_state(True)
 
     @property
-    def min_temp(self):
-        """Return the minimum temperature."""
-        if "_ch" in self._unique_id:
-            return 4 if self._mode else 35
-        return 35
+    def available(self):
+        """Return False while the device is not heard from."""
+        return self._airtub.available
 
     @property
-    def max_temp(self):
-        """Return the maximum temperature."""
-        if "_ch" in self._unique_id:
-            return 30 if self._mode else 80
-        return 60
-
-    @property
-    def hvac_action(self):
-        """Return current HVAC mode."""
-        return self._operation if "_ch" in self._unique_id else self._dhw_operation
+    def assumed_state(self):
+        """Return True while the entity shows cached data."""
+        return self._airtub.stale
 
     async def async_set_hvac_mode(self, hvac_mode):
         """Set new target hvac mode."""
-        mode = "1" if hvac_mode == HVACMode.HEAT else "0"
-        command = None
-        if "_ch" in self._unique_id:
-            if self._mode:
-                self._hvac_mode = hvac_mode
-                command = '{"atm":' + mode + "}"
-            else:
-                self._man_hvac_mode = hvac_mode
-                command = '{"tcm":' + mode + "}"
-        else:
-            self._dhw_mode = hvac_mode
-            command = '{"tdm":' + mode + "}"
-
-        # 准备要发送的 JSON 数据
-        json_data = {"cmd": command}
-
-        # 禁用自动更新
-        self._disable_update = True
-
-        # 调用 service 发送数据
-        await self._hass.services.async_call(
-            DOMAIN, "sender", json_data  # 你的 domain  # 你的 service 名  # 传递的数据
-        )
-
-        # 启用自动更新
-        await asyncio.sleep(3)  # 等待一段时间
-        self._disable_update = False
-
-        self.async_write_ha_state()
+        self._attr_hvac_mode = hvac_mode
+        self._send_optimistic({self.switch_key: 1 if hvac_mode == HVACMode.HEAT else 0})
 
     async def async_set_temperature(self, **kwargs):
         """Set new target temperature."""
-        command = None
-        if ATTR_TEMPERATURE in kwargs:
-            if "_ch" in self._unique_id:
-                if self._mode:
-                    self._target_temperature = kwargs[ATTR_TEMPERATURE]
-                    command = '{"trt":' + str(self._target_temperature) + "}"
-                else:
-                    self._man_target_temperature = kwargs[ATTR_TEMPERATURE]
-                    command = '{"tct":' + str(self._man_target_temperature) + "}"
-            else:
-                self._dhw_target_temperature = kwargs[ATTR_TEMPERATURE]
-                command = '{"tdt":' + str(self._dhw_target_temperature) + "}"
-            json_data = {"cmd": command}
-
-            # 禁用自动更新
-            self._disable_update = True
-
-            await self._hass.services.async_call(DOMAIN, "sender", json_data)
-
-            # 启用自动更新
-            await asyncio.sleep(3)  # 等待一段时间
-            self._disable_update = False
-
+        if ATTR_TEMPERATURE not in kwargs:
+            return
+        self._attr_target_temperature = kwargs[ATTR_TEMPERATURE]
+        self._send_optimistic({self.target_key: self._attr_target_temperature})
+
+    @callback
+    def _send_optimistic(self, command):
+        """Queue a command and show its value until the device confirms it."""
+        for key, value in command.items():
+            self._cancel_pending(key)
+            self._pending[key] = (
+                value,
+                async_call_later(
+                    self.hass, PENDING_TIMEOUT, partial(self._pending_expired, key, value)
+                ),
+            )
+            waiter = self._airtub.coalescer.async_queue({key: value})
+            waiter.add_done_callback(partial(self._command_done, key, value))
         self.async_write_ha_state()
 
+    @callback
+    def _command_done(self, key, value, waiter):
+        """Roll back right away when the device never acknowledged the command."""
+        if waiter.cancelled() or not waiter.result():
+            self._rollback(key, value)
+
+    @callback
+    def _pending_expired(self, key, value, _now):
+        """Roll back when the device did not report the value in time."""
+        self._rollback(key, value)
+
+    @callback
+    def _rollback(self, key, value):
+        """Drop an unconfirmed command and show the reported value again."""
+        pending = self._pending.get(key)
+        if pending is None or pending[0] != value:
+            return
+        if self._airtub.telemetry.get(key) != value:
+            _LOGGER.warning("AIRTUB: %s=%s was not confirmed by the device", key, value)
+        self._cancel_pending(key)
+        self.async_schedule_update_ha_state(True)
+
+    @callback
+    def _cancel_pending(self, key):
+        """Forget a pending command and its timeout."""
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            pending[1]()
+
+    def _reported(self, values, key, index, default):
+        """Return the reported value, or the optimistic one while a command is pending."""
+        value = values[index]
+        pending = self._pending.get(key)
+        if pending is not None:
+            if value != pending[0]:
+                return pending[0]
+            self._cancel_pending(key)  # 设备已确认
+        return default if value is None else value
+
     async def async_update(self):
         """Fetch new state data for the climate entity."""
 
-        if self._disable_update:
-            return
-
         if not self.hass:
             return
 
-        data = self._hass.data.get(DOMAIN, {}).get("data", {})
-        if not data:
-            return
-
-        current_heating_mode = data.get("atm", self._mode)
-        if current_heating_mode != self._mode and not self._mode_set:
-            command = '{"atm":' + str(self._mode) + "}"
-            json_data = {"cmd": command}
-            await self._hass.services.async_call(DOMAIN, "sender", json_data)
-            await asyncio.sleep(5)
-        else:
-            self._mode_set = True
-
-        if "_ch" in self._unique_id:
-            if self._mode:
-                op_mode = data.get("atm", self._mode)
-                self._hvac_mode = HVACMode.HEAT if op_mode else HVACMode.OFF
-                self._temperature = data.get("crt", self._temperature)
-                self._target_temperature = data.get("trt", self._target_temperature)
-                mode = data.get("ccm", 0)
-                fst = data.get("fst", 0)
-                self._operation = "🔥加热中" if (mode and fst) else "待机"
-            else:
-                op_mode = data.get("tcm", self._mode)
-                self._man_hvac_mode = HVACMode.HEAT if op_mode else HVACMode.OFF
-                self._man_temperature = data.get("cct", self._man_temperature)
-                self._man_target_temperature = data.get(
-                    "tct", self._man_target_temperature
-                )
-                mode = data.get("ccm", 0)
-                fst = data.get("fst", 0)
-                self._operation = "🔥加热中" if (mode and fst) else "待机"
-        else:
-            mode = data.get("tdm", self._dhw_mode)
-            self._dhw_mode = HVACMode.HEAT if mode else HVACMode.OFF
-            self._dhw_temperature = data.get("cdt", self._dhw_temperature)
-            self._dhw_target_temperature = data.get("tdt", self._dhw_target_temperature)
-            mode = data.get("cdm", 0)
-            fst = data.get("fst", 0)
-            self._dhw_operation = "🔥加热中" if (mode and fst) else "待机"
+        values = self._airtub.telemetry.values
+        switch = self._reported(
+            values, self.switch_key, self._switch, int(self._attr_hvac_mode == HVACMode.HEAT)
+        )
+        self._attr_hvac_mode = HVACMode.HEAT if switch else HVACMode.OFF
+        current = values[self._current]
+        if current is not None:
+            self._attr_current_temperature = current
+        self._attr_target_temperature = self._reported(
+            values, self.target_key, self._target, self._attr_target_temperature
+        )
+        self._attr_hvac_action = HEATING if (values[self._demand] and values[FST]) else IDLE
 
         self.async_write_ha_state()
+
+
+class AirtubChAutoClimate(AirtubClimateDevice):
+    """Central heating controlled by room temperature."""
+
+    _attr_translation_key = "ch_auto_control"
+    _attr_icon = "mdi:radiator"
+    _attr_min_temp = 4
+    _attr_max_temp = 30
+    circuit = "ch"
+    switch_key = "atm"
+    current_key = "crt"
+    target_key = "trt"
+    demand_key = "ccm"
+
+
+class AirtubChManualClimate(AirtubClimateDevice):
+    """Central heating controlled by flow water temperature."""
+
+    _attr_translation_key = "ch_man_control"
+    _attr_icon = "mdi:radiator"
+    _attr_min_temp = 35
+    _attr_max_temp = 80
+    circuit = "ch"
+    switch_key = "tcm"
+    current_key = "cct"
+    target_key = "tct"
+    demand_key = "ccm"
+
+
+class AirtubDhwClimate(AirtubClimateDevice):
+    """Domestic hot water."""
+
+    _attr_translation_key = "dhw_control"
+    _attr_icon = "mdi:shower"
+    _attr_min_temp = 35
+    _attr_max_temp = 60
+    circuit = "dhw"
+    switch_key = "tdm"
+    current_key = "cdt"
+    target_key = "tdt"
+    demand_key = "cdm"
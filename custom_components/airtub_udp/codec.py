@@ -0,0 +1,97 @@
+"""Airtub Partner wire format codec."""
+
+import json
+import struct
+import zlib
+
+# msgtype, payload length, 2 pad bytes, little endian CRC32 of the payload
+HEADER = struct.Struct("<BB2xI")
+MAX_PAYLOAD = 255
+JSON_OBJECT_START = ord("{")
+
+# Reasons AirtubCodec.decode rejected the last frame
+REJECT_SECRET = "secret"
+REJECT_CRC = "crc"
+REJECT_JSON = "json"
+
+
+class AirtubCodec:
+    """Encode/decode Airtub frames for a single device secret.
+
+    The XOR keystream is the secret repeated, so it is expanded once up to the
+    largest payload the one byte length field allows and kept as integers, one
+    per payload length. Whole buffers are then XORed with a single big integer
+    operation instead of character by character.
+    """
+
+    __slots__ = ("_keys", "_first", "last_error")
+
+    def __init__(self, secret: str):
+        """Initialize the codec."""
+        key = secret.encode("ascii") or b"\0"
+        stream = (key * (MAX_PAYLOAD // len(key) + 1))[:MAX_PAYLOAD]
+        self._keys = [
+            int.from_bytes(stream[:size], "little") for size in range(MAX_PAYLOAD + 1)
+        ]
+        self._first = stream[0]
+        self.last_error = None
+
+    def xor(self, data: bytes) -> bytes:
+        """XOR encode/decode a buffer of at most MAX_PAYLOAD bytes."""
+        size = len(data)
+        return (int.from_bytes(data, "little") ^ self._keys[size]).to_bytes(
+            size, "little"
+        )
+
+    def pack(self, msgtype: int, message: bytes) -> bytes:
+        """Encode data to send over UDP."""
+        if len(message) > MAX_PAYLOAD:
+            raise ValueError(f"Payload too long: {len(message)} bytes")
+        crypt_data = self.xor(message)
+        return HEADER.pack(msgtype, len(crypt_data), zlib.crc32(crypt_data)) + crypt_data
+
+    def _payload(self, data: bytes):
+        """Return (msgtype, encrypted payload), or None for a truncated/corrupt frame."""
+        if len(data) < HEADER.size:
+            return None
+        msgtype, datalen, crc = HEADER.unpack_from(data)
+        realdata = data[HEADER.size : HEADER.size + datalen]
+        if len(realdata) != datalen or zlib.crc32(realdata) != crc:
+            return None
+        return msgtype, realdata
+
+    def unpack(self, data: bytes):
+        """Decode data received from UDP.
+
+        Returns (msgtype, payload), or None when the frame is truncated or the
+        CRC does not match, in which case the payload is never decrypted.
+        """
+        frame = self._payload(data)
+        if frame is None:
+            return None
+        return frame[0], self.xor(frame[1])
+
+    def decode(self, data: bytes):
+        """Decode a datagram straight into its JSON object.
+
+        Frames encrypted with another secret are rejected on their first byte,
+        which has to decrypt to "{", before the CRC or the XOR are computed.
+        Returns None for anything that is not an intact JSON object, with the
+        reason left in last_error.
+        """
+        if len(data) <= HEADER.size or data[HEADER.size] ^ self._first != JSON_OBJECT_START:
+            self.last_error = REJECT_SECRET
+            return None
+        frame = self._payload(data)
+        if frame is None:
+            self.last_error = REJECT_CRC
+            return None
+        try:
+            message = json.loads(self.xor(frame[1]))
+        except ValueError:
+            self.last_error = REJECT_JSON
+            return None
+        if not isinstance(message, dict):
+            self.last_error = REJECT_JSON
+            return None
+        return message
@@ -0,0 +1,198 @@
+"""Ack-driven command sender for the Airtub Partner."""
+
+import asyncio
+import json
+import time
+
+MSG_TYPE = 4
+RETRY_MAX = 5
+
+# Retransmission timeout bounds in seconds, estimated as in RFC 6298
+INITIAL_RTO = 1.0
+MIN_RTO = 0.2
+MAX_RTO = 5.0
+
+
+class CommandSender:
+    """Send commands one at a time and wait for the device's "rec" ack.
+
+    A command is sent immediately and retransmitted with exponential backoff
+    until the ack arrives or RETRY_MAX attempts have been made. The timeout
+    follows the smoothed round-trip time, and only commands that were acked
+    on the first attempt are sampled (Karn's algorithm).
+
+    The device acks every transmission it receives, so a retransmitted command
+    can be acked more than once. The extra acks are expected for up to MAX_RTO
+    after the command completes and are dropped, so a late one cannot ack the
+    next command or give it a near-zero RTT sample.
+    """
+
+    def __init__(self, codec):
+        """Initialize the sender."""
+        self.transport = None
+        # profile 服务运行期间的 HotPathProfiler
+        self.profiler = None
+        self._codec = codec
+        self._lock = asyncio.Lock()
+        self._ack = None
+        # 已完成命令尚未到达的多余应答数及其截止时间
+        self._strays = 0
+        self._strays_until = 0.0
+        self.srtt = None
+        self.rttvar = None
+        self.rto = INITIAL_RTO
+        self.last_rtt = None
+        self.commands = 0
+        self.sent = 0
+        self.retransmits = 0
+        self.acks = 0
+        self.failures = 0
+        self.stray_acks = 0
+
+    @property
+    def awaiting_ack(self) -> bool:
+        """Return True while a command is waiting for its ack."""
+        return self._ack is not None and not self._ack.done()
+
+    def ack_received(self):
+        """Resolve the command in flight, unless the ack is a stray one."""
+        now = time.monotonic()
+        if self._strays:
+            if now < self._strays_until:
+                self._strays -= 1
+                self.stray_acks += 1
+                return
+            self._strays = 0
+        if self._ack is not None and not self._ack.done():
+            self._ack.set_result(now)
+
+    async def async_send(self, message: dict, addr) -> bool:
+        """Send a command and return whether the device acknowledged it."""
+        async with self._lock:
+            self._ack = asyncio.get_running_loop().create_future()
+            self.commands += 1
+            rto = self.rto
+            transmissions = 0
+            try:
+                for attempt in range(RETRY_MAX):
+                    message["try"] = attempt
+                    sent_at = time.monotonic()
+                    if self.profiler is None:
+                        self._transmit(message, addr)
+                    else:
+                        self.profiler.call(self._transmit, message, addr)
+                    transmissions += 1
+                    self.sent += 1
+                    if attempt:
+                        self.retransmits += 1
+                    try:
+                        acked_at = await asyncio.wait_for(asyncio.shield(self._ack), rto)
+                    except asyncio.TimeoutError:
+                        rto = min(rto * 2, MAX_RTO)
+                        continue
+                    self.acks += 1
+                    if attempt == 0:
+                        self._sample_rtt(acked_at - sent_at)
+                    return True
+                # 保留退避后的超时时间，直到下一次有效的 RTT 采样
+                self.rto = rto
+                self.failures += 1
+                return False
+            finally:
+                # 每次发送都可能收到一次应答，第一次之外的都是多余应答；
+                # 全部重试都无应答时设备多半离线，不再忽略之后的应答
+                acked = self._ack.done() and not self._ack.cancelled()
+                self._strays = transmissions - 1 if acked else 0
+                self._strays_until = time.monotonic() + MAX_RTO
+                self._ack = None
+
+    def _transmit(self, message: dict, addr):
+        """Encode a command and send it."""
+        data = self._codec.pack(
+            MSG_TYPE, json.dumps(message, separators=(",", ":")).encode("ascii")
+        )
+        self.transport.sendto(data, addr)
+
+    def _sample_rtt(self, rtt: float):
+        """Update the smoothed RTT estimate and the retransmission timeout."""
+        self.last_rtt = rtt
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.rto = min(max(self.srtt + 4 * self.rttvar, MIN_RTO), MAX_RTO)
+
+    def link_quality(self) -> dict:
+        """Return the RTT and retry statistics."""
+        return {
+            "commands": self.commands,
+            "sent": self.sent,
+            "retransmits": self.retransmits,
+            "acks": self.acks,
+            "failures": self.failures,
+            "stray_acks": self.stray_acks,
+            "last_rtt": None if self.last_rtt is None else round(self.last_rtt, 3),
+            "srtt": None if self.srtt is None else round(self.srtt, 3),
+            "rto": round(self.rto, 3),
+        }
+
+
+class CommandCoalescer:
+    """Merge commands queued within a short window into a single command.
+
+    Keys queued while the window is open are merged into one JSON object with
+    the last write winning per key, so a slider drag or an automation setting
+    mode and temperature together goes out as one datagram.
+    """
+
+    def __init__(self, send, window: float):
+        """Initialize the coalescer."""
+        self._send = send
+        self._window = window
+        self._pending = {}
+        self._waiters = []
+        self._handle = None
+        self._tasks = set()
+
+    def async_queue(self, command: dict) -> asyncio.Future:
+        """Queue command keys; the future resolves to whether they were acked."""
+        loop = asyncio.get_running_loop()
+        self._pending.update(command)
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        if self._handle is None:
+            self._handle = loop.call_later(self._window, self._flush)
+        return waiter
+
+    def _flush(self):
+        """Send everything queued during the window."""
+        self._handle = None
+        pending, waiters = self._pending, self._waiters
+        self._pending, self._waiters = {}, []
+        task = asyncio.get_running_loop().create_task(self._send_merged(pending, waiters))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_merged(self, pending: dict, waiters: list):
+        """Send a merged command and resolve its waiters."""
+        acked = False
+        try:
+            acked = await self._send(pending)
+        finally:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(acked)
+
+    def cancel(self):
+        """Drop queued commands and stop sends in progress."""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(False)
+        self._pending, self._waiters = {}, []
+        for task in self._tasks:
+            task.cancel()
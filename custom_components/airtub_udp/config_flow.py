@@ -5,13 +5,55 @@
 import logging
 import voluptuous as vol
 from homeassistant import config_entries
+from homeassistant.components.network import async_get_adapters
 from homeassistant.core import callback
-from homeassistant.const import CONF_DEVICE, CONF_PASSWORD, CONF_MODE
+from homeassistant.const import CONF_DEVICE, CONF_PASSWORD, CONF_MODE, CONF_HOST
 from homeassistant.helpers.selector import selector
-from .const import DOMAIN
+from .const import (
+    DOMAIN,
+    CONF_MIN_INTERVAL,
+    CONF_FLUSH_INTERVAL,
+    CONF_COMMAND_WINDOW,
+    CONF_INTERFACES,
+    CONF_JOURNAL,
+    CONF_STALE_TIMEOUT,
+    CONF_TRANSPORT,
+    DEFAULT_DEADBANDS,
+    DEFAULT_MIN_INTERVAL,
+    DEFAULT_FLUSH_INTERVAL,
+    DEFAULT_COMMAND_WINDOW,
+    DEFAULT_STALE_TIMEOUT,
+    TRANSPORT_MULTICAST,
+    TRANSPORT_UNICAST,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
+TRANSPORT_SELECTOR = selector(
+    {
+        "select": {
+            "options": [TRANSPORT_MULTICAST, TRANSPORT_UNICAST],
+            "translation_key": "transport",
+        }
+    }
+)
+
+
+async def _interface_options(hass):
+    """Return the IPv4 addresses of the host's adapters as select options."""
+    return [
+        {"value": address["address"], "label": f"{adapter['name']} ({address['address']})"}
+        for adapter in await async_get_adapters(hass)
+        for address in adapter["ipv4"]
+    ]
+
+
+def _validate_transport(user_input):
+    """Return the form errors of the transport settings."""
+    if user_input.get(CONF_TRANSPORT) == TRANSPORT_UNICAST and not user_input.get(CONF_HOST):
+        return {CONF_HOST: "host_required"}
+    return {}
+
 
 @config_entries.HANDLERS.register(DOMAIN)
 class AirtubUDPConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -25,12 +67,14 @@ class AirtubUDPConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     async def async_step_user(self, user_input=None):
         """Handle the initial step."""
-        await self.async_set_unique_id("airtub_udp_config_flow")
-        self._abort_if_unique_id_configured()
-
         if user_input is not None:
-            device_name = user_input.get(CONF_DEVICE, "device serial").upper()
-            return self.async_create_entry(title=device_name, data=user_input)
+            # 以设备序列号区分多个雅图伴侣
+            await self.async_set_unique_id(user_input[CONF_DEVICE].lower())
+            self._abort_if_unique_id_configured()
+            self._errors = _validate_transport(user_input)
+            if not self._errors:
+                device_name = user_input.get(CONF_DEVICE, "device serial").upper()
+                return self.async_create_entry(title=device_name, data=user_input)
 
         return self._show_config_form(user_input)
 
@@ -55,6 +99,11 @@ class AirtubUDPConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                         }
                     }
                 ),
+                vol.Required(
+                    CONF_TRANSPORT,
+                    default=user_input.get(CONF_TRANSPORT, TRANSPORT_MULTICAST),
+                ): TRANSPORT_SELECTOR,
+                vol.Optional(CONF_HOST, default=user_input.get(CONF_HOST, "")): str,
             }
         )
         return self.async_show_form(
@@ -89,7 +138,8 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
 
     async def async_step_user(self, user_input=None):
         """Manage the user configuration options."""
-        if user_input is not None:
+        errors = _validate_transport(user_input) if user_input is not None else {}
+        if user_input is not None and not errors:
             # 当用户提交新的配置时，更新配置项并重新加载配置条目
             # 先创建 entry 再 reload
             self.hass.config_entries.async_update_entry(
@@ -105,13 +155,15 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
             )  # 无需返回 data，因为它已被保存在 options 中
 
         # 显示表单，用户可编辑选项
+        options = {**self.config_entry.data, **self.config_entry.options}
+        interfaces = await _interface_options(self.hass)
         return self.async_show_form(
             step_id="user",
             data_schema=vol.Schema(
                 {
                     vol.Required(
                         CONF_MODE,
-                        default=self.config_entry.options.get(CONF_MODE, "auto"),
+                        default=options.get(CONF_MODE, "auto"),
                     ): selector(
                         {
                             "select": {
@@ -120,6 +172,42 @@ class OptionsFlowHandler(config_entries.OptionsFlow):
                             }
                         }
                     ),
+                    **{
+                        vol.Required(
+                            option, default=options.get(option, default)
+                        ): vol.All(vol.Coerce(float), vol.Range(min=0))
+                        for option, default in DEFAULT_DEADBANDS.items()
+                    },
+                    vol.Required(
+                        CONF_MIN_INTERVAL,
+                        default=options.get(CONF_MIN_INTERVAL, DEFAULT_MIN_INTERVAL),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                    vol.Required(
+                        CONF_FLUSH_INTERVAL,
+                        default=options.get(CONF_FLUSH_INTERVAL, DEFAULT_FLUSH_INTERVAL),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=0)),
+                    vol.Required(
+                        CONF_COMMAND_WINDOW,
+                        default=options.get(CONF_COMMAND_WINDOW, DEFAULT_COMMAND_WINDOW),
+                    ): vol.All(vol.Coerce(float), vol.Range(min=0, max=5)),
+                    vol.Required(
+                        CONF_STALE_TIMEOUT,
+                        default=options.get(CONF_STALE_TIMEOUT, DEFAULT_STALE_TIMEOUT),
+                    ): vol.All(vol.Coerce(int), vol.Range(min=10)),
+                    vol.Required(
+                        CONF_TRANSPORT,
+                        default=options.get(CONF_TRANSPORT, TRANSPORT_MULTICAST),
+                    ): TRANSPORT_SELECTOR,
+                    vol.Optional(CONF_HOST, default=options.get(CONF_HOST, "")): str,
+                    vol.Optional(
+                        CONF_INTERFACES, default=options.get(CONF_INTERFACES, [])
+                    ): selector(
+                        {"select": {"options": interfaces, "multiple": True, "mode": "list"}}
+                    ),
+                    vol.Required(
+                        CONF_JOURNAL, default=options.get(CONF_JOURNAL, False)
+                    ): bool,
                 }
             ),
+            errors=errors,
         )
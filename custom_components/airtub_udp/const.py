@@ -1,4 +1,37 @@
 DOMAIN = "airtub_udp"
-EVENT_NEW_DATA = "airtub_new_data_received"
 UDP_GROUP = "224.0.1.3"
 UDP_PORT = 4211
+SIGNAL_UPDATE = "airtub_udp_update_{}_{}"
+# 从缓存恢复后首次收到实时数据
+SIGNAL_LIVE = "airtub_udp_live_{}"
+# 设备数据超时或恢复，参数为是否可用
+SIGNAL_AVAILABLE = "airtub_udp_available_{}"
+# 设备开始上报新的数据键
+SIGNAL_NEW_KEYS = "airtub_udp_new_keys_{}"
+
+STORAGE_VERSION = 1
+STORAGE_KEY = "airtub_udp.{}"
+
+CONF_TRANSPORT = "transport"
+TRANSPORT_MULTICAST = "multicast"
+TRANSPORT_UNICAST = "unicast"
+
+CONF_TEMP_DEADBAND = "temp_deadband"
+CONF_GAS_DEADBAND = "gas_deadband"
+CONF_MOD_DEADBAND = "mod_deadband"
+CONF_MIN_INTERVAL = "min_interval"
+CONF_FLUSH_INTERVAL = "flush_interval"
+CONF_COMMAND_WINDOW = "command_window"
+CONF_JOURNAL = "journal"
+CONF_STALE_TIMEOUT = "stale_timeout"
+CONF_INTERFACES = "interfaces"
+
+DEFAULT_DEADBANDS = {
+    CONF_TEMP_DEADBAND: 0.2,
+    CONF_GAS_DEADBAND: 0.01,
+    CONF_MOD_DEADBAND: 5,
+}
+DEFAULT_MIN_INTERVAL = 10
+DEFAULT_FLUSH_INTERVAL = 300
+DEFAULT_COMMAND_WINDOW = 0.5
+DEFAULT_STALE_TIMEOUT = 120
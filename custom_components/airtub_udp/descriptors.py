@@ -0,0 +1,99 @@
+"""Per-key entity descriptors of the Airtub telemetry."""
+
+# pylint: disable=import-error
+
+from dataclasses import dataclass, replace
+from typing import Callable, Optional
+from homeassistant.components.sensor import SensorDeviceClass, SensorStateClass
+from homeassistant.const import UnitOfTemperature, PERCENTAGE
+from .const import CONF_GAS_DEADBAND, CONF_MOD_DEADBAND, CONF_TEMP_DEADBAND
+
+
+def _fault_code(value):
+    """Format a fault number as shown on the boiler, e.g. E03."""
+    code = int(value)
+    return "off" if code == 0 else f"E{code:02}"
+
+
+@dataclass(frozen=True)
+class KeyDescriptor:
+    """How the entity of one telemetry key is created and formatted."""
+
+    binary: bool = False
+    unit: Optional[str] = None
+    device_class: Optional[str] = None
+    state_class: Optional[str] = SensorStateClass.MEASUREMENT
+    icon: str = "mdi:numeric"
+    precision: Optional[int] = 0
+    formatter: Optional[Callable] = None
+    # 死区配置项，None 表示每次变化都立即写入
+    deadband: Optional[str] = None
+
+    def format(self, value):
+        """Return the state shown for a converted value."""
+        if self.formatter is not None:
+            return self.formatter(value)
+        if self.precision is None:
+            return value
+        return round(value, self.precision)
+
+
+NUMERIC = KeyDescriptor()
+BINARY = KeyDescriptor(
+    binary=True,
+    device_class="opening",
+    state_class=None,
+    icon="mdi:toggle-switch-variant",
+    precision=None,
+)
+_TEMPERATURE = KeyDescriptor(
+    unit=UnitOfTemperature.CELSIUS,
+    device_class=SensorDeviceClass.TEMPERATURE,
+    icon="mdi:thermometer",
+)
+
+KEY_DESCRIPTORS = {
+    "crt": replace(_TEMPERATURE, precision=1, deadband=CONF_TEMP_DEADBAND),
+    "trt": replace(_TEMPERATURE, precision=1),
+    "cct": replace(_TEMPERATURE, deadband=CONF_TEMP_DEADBAND),
+    "cdt": replace(_TEMPERATURE, deadband=CONF_TEMP_DEADBAND),
+    "odt": replace(_TEMPERATURE, deadband=CONF_TEMP_DEADBAND),
+    "tct": _TEMPERATURE,
+    "tdt": _TEMPERATURE,
+    "mod": KeyDescriptor(unit=PERCENTAGE, icon="mdi:percent-box", deadband=CONF_MOD_DEADBAND),
+    "gas": KeyDescriptor(
+        unit="m³",
+        device_class=SensorDeviceClass.GAS,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        icon="mdi:meter-gas",
+        precision=6,
+        deadband=CONF_GAS_DEADBAND,
+    ),
+    "flt": KeyDescriptor(
+        state_class=None, icon="mdi:alert-octagram", precision=None, formatter=_fault_code
+    ),
+    "pwr": KeyDescriptor(icon="mdi:battery"),
+    "tol": NUMERIC,
+    "coe": NUMERIC,
+    "tdf": NUMERIC,
+    "fst": BINARY,
+    "loc": BINARY,
+    "ovr": BINARY,
+    "sch": BINARY,
+    "tmd": BINARY,
+    "vir": BINARY,
+    "atm": BINARY,
+    "tcm": BINARY,
+    "tdm": BINARY,
+    "ccm": BINARY,
+    "cdm": BINARY,
+}
+
+
+def describe(key: str) -> KeyDescriptor:
+    """Return the descriptor of a key, guessing one for keys not listed."""
+    descriptor = KEY_DESCRIPTORS.get(key)
+    if descriptor is None:
+        # 设备的开关类数据键以 m 结尾
+        descriptor = BINARY if key.endswith("m") else NUMERIC
+    return descriptor
@@ -0,0 +1,32 @@
+"""Diagnostics support for Airtub UDP."""
+
+# pylint: disable=import-error
+
+from homeassistant.components.diagnostics import async_redact_data
+from homeassistant.const import CONF_PASSWORD
+from .const import DOMAIN
+
+TO_REDACT = {CONF_PASSWORD}
+
+
+async def async_get_config_entry_diagnostics(hass, entry):
+    """Return diagnostics for a config entry."""
+    airtub = hass.data[DOMAIN][entry.entry_id]
+    listener = airtub.listener
+    return {
+        "entry": async_redact_data(entry.as_dict(), TO_REDACT),
+        "device": {
+            "ip": airtub.ip,
+            "data": airtub.telemetry.as_dict(),
+            "stats": airtub.stats.as_dict(),
+            "sender": airtub.sender.link_quality(),
+        },
+        "listener": {
+            "bind_ip": listener.bind_ip,
+            "multicast": listener.multicast,
+            "memberships": sorted(listener.memberships),
+            "devices": list(listener.devices),
+            "journal": listener.journal is not None,
+            "stats": listener.stats.as_dict(),
+        },
+    }
@@ -0,0 +1,168 @@
+"""Bounded in-memory history of numeric Airtub telemetry."""
+
+import math
+from array import array
+from .telemetry import FIELD_INDEX
+
+HISTORY_KEYS = ("crt", "cct", "mod", "gas")
+# 原始采样点数，约为设备15分钟的上报量
+RAW_SAMPLES = 900
+# 汇总周期（秒）与保留的桶数：1分钟保留1小时，15分钟保留1天
+ROLLUPS = {"1m": (60, 60), "15m": (900, 96)}
+RESOLUTIONS = ("raw", *ROLLUPS)
+# 作为状态属性公开的汇总值，不写入记录器数据库
+HISTORY_ATTRIBUTES = frozenset(
+    f"{stat}_{name}" for stat in ("min", "max", "mean") for name in ROLLUPS
+)
+
+
+class SampleRing:
+    """Fixed size ring of (timestamp, value) samples."""
+
+    __slots__ = ("_times", "_values", "_size", "_next", "_count")
+
+    def __init__(self, size: int):
+        """Initialize the ring."""
+        self._times = array("d", bytes(8 * size))
+        self._values = array("d", bytes(8 * size))
+        self._size = size
+        self._next = 0
+        self._count = 0
+
+    def append(self, timestamp: float, value: float):
+        """Store a sample, overwriting the oldest once the ring is full."""
+        index = self._next
+        self._times[index] = timestamp
+        self._values[index] = value
+        index += 1
+        if index == self._size:
+            index = 0
+        self._next = index
+        if self._count < self._size:
+            self._count += 1
+
+    def samples(self):
+        """Yield the samples, oldest first."""
+        size = self._size
+        start = (self._next - self._count) % size
+        for offset in range(self._count):
+            index = (start + offset) % size
+            yield self._times[index], self._values[index]
+
+
+class Rollup:
+    """Min, max and mean per fixed period, kept for a fixed number of periods.
+
+    Each sample only updates the bucket of its period, so the aggregates cost
+    O(1) per frame and are never recomputed from the raw samples.
+    """
+
+    __slots__ = ("period", "_start", "_min", "_max", "_sum", "_count", "_current", "_end")
+
+    def __init__(self, period: int, size: int):
+        """Initialize the rollup."""
+        self.period = period
+        self._start = array("d", bytes(8 * size))
+        self._min = array("d", bytes(8 * size))
+        self._max = array("d", bytes(8 * size))
+        self._sum = array("d", bytes(8 * size))
+        self._count = array("L", bytes(array("L").itemsize * size))
+        self._current = -1
+        # 当前桶的结束时间
+        self._end = 0.0
+
+    def add(self, timestamp: float, value: float):
+        """Fold a sample into the bucket of its period."""
+        index = self._current
+        if timestamp >= self._end:
+            start = timestamp - timestamp % self.period
+            index = self._current = (index + 1) % len(self._start)
+            self._start[index] = start
+            self._end = start + self.period
+            self._min[index] = self._max[index] = self._sum[index] = value
+            self._count[index] = 1
+            return
+        if timestamp < self._start[index]:
+            return  # 时钟回拨，丢弃旧样本
+        if value < self._min[index]:
+            self._min[index] = value
+        elif value > self._max[index]:
+            self._max[index] = value
+        self._sum[index] += value
+        self._count[index] += 1
+
+    def buckets(self):
+        """Yield (start, min, max, mean) per period, oldest first."""
+        if self._current < 0:
+            return
+        size = len(self._start)
+        for offset in range(1, size + 1):
+            index = (self._current + offset) % size
+            count = self._count[index]
+            if count:
+                yield (
+                    self._start[index],
+                    self._min[index],
+                    self._max[index],
+                    self._sum[index] / count,
+                )
+
+    def last_complete(self):
+        """Return the most recent bucket whose period has ended, or None."""
+        if self._current < 0:
+            return None
+        index = (self._current - 1) % len(self._start)
+        count = self._count[index]
+        if not count:
+            return None
+        return self._start[index], self._min[index], self._max[index], self._sum[index] / count
+
+
+class KeyHistory:
+    """Raw samples and rollups of one telemetry key."""
+
+    __slots__ = ("raw", "rollups", "_adders")
+
+    def __init__(self):
+        """Initialize the history."""
+        self.raw = SampleRing(RAW_SAMPLES)
+        self.rollups = {name: Rollup(period, size) for name, (period, size) in ROLLUPS.items()}
+        self._adders = (self.raw.append, *(rollup.add for rollup in self.rollups.values()))
+
+    def add(self, timestamp: float, value: float):
+        """Record a sample."""
+        for add in self._adders:
+            add(timestamp, value)
+
+    def attributes(self) -> dict:
+        """Return the last complete rollup of each resolution as state attributes."""
+        attributes = {}
+        for name, rollup in self.rollups.items():
+            bucket = rollup.last_complete()
+            if bucket is not None:
+                attributes[f"min_{name}"] = bucket[1]
+                attributes[f"max_{name}"] = bucket[2]
+                attributes[f"mean_{name}"] = round(bucket[3], 3)
+        return attributes
+
+
+class DeviceHistory:
+    """History of the numeric keys of one device.
+
+    The memory used is fixed when the device is set up and does not grow with
+    uptime: RAW_SAMPLES samples plus the rollup buckets for each key.
+    """
+
+    __slots__ = ("keys", "_fields")
+
+    def __init__(self, keys=HISTORY_KEYS):
+        """Initialize the history."""
+        self.keys = {key: KeyHistory() for key in keys}
+        self._fields = tuple((FIELD_INDEX[key], history) for key, history in self.keys.items())
+
+    def record(self, timestamp: float, values: list):
+        """Sample the tracked fields of a telemetry record."""
+        for index, history in self._fields:
+            value = values[index]
+            if isinstance(value, (int, float)) and math.isfinite(value):
+                history.add(timestamp, value)
@@ -0,0 +1,613 @@
+"""Shared UDP listener and per-device runtime state for Airtub Partner."""
+
+# pylint: disable=broad-except, too-many-instance-attributes, too-many-arguments, import-error
+
+import errno
+import logging
+import socket
+import time
+from datetime import timedelta
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_send
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.helpers.storage import Store
+from .codec import AirtubCodec, HEADER, REJECT_CRC, REJECT_JSON
+from .history import DeviceHistory
+from .command import CommandCoalescer, CommandSender
+from .journal import FrameJournal
+from .metrics import DerivedMetrics
+from .stats import DeviceStats, ListenerStats
+from .telemetry import FULL_FRAME_KEY, Telemetry
+from .const import (
+    DOMAIN,
+    SIGNAL_AVAILABLE,
+    SIGNAL_LIVE,
+    SIGNAL_NEW_KEYS,
+    SIGNAL_UPDATE,
+    STORAGE_KEY,
+    STORAGE_VERSION,
+    UDP_GROUP,
+    UDP_PORT,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+RECV_BUFFER_SIZE = 1024
+# 每次唤醒最多读取的数据报数，避免持续的数据流占住事件循环
+MAX_DRAIN = 64
+# socket 模块在部分 Python 版本中没有 IP_PKTINFO，使用 Linux 的取值
+IP_PKTINFO = getattr(socket, "IP_PKTINFO", 8)
+# struct in_pktinfo 的空间
+PKTINFO_SPACE = socket.CMSG_SPACE(12)
+# 由内核选择组播网卡
+ANY_INTERFACE = "0.0.0.0"
+# 与上一帧有效数据CRC相同的数据帧在该时间（秒）内视为重复帧
+DEDUP_WINDOW = 2.0
+JOURNAL_DIR = f"{DOMAIN}_journal"
+JOURNAL_FLUSH_INTERVAL = timedelta(seconds=10)
+# 最新数据写入缓存的最短间隔（秒）
+SNAPSHOT_SAVE_DELAY = 60
+# 上报间隔的初始估计与平滑系数，超过 MAX_REPORT_GAP 的间隔不参与估计
+DEFAULT_REPORT_INTERVAL = 5.0
+REPORT_INTERVAL_GAIN = 0.1
+MAX_REPORT_GAP = 60.0
+# 超过 STALE_FACTOR 倍上报间隔（至少 MIN_STALE_AFTER 秒）没有数据视为中断
+STALE_FACTOR = 5
+MIN_STALE_AFTER = 30.0
+# 恢复操作的退避时间（秒）
+RECOVERY_BACKOFF_MIN = 30.0
+RECOVERY_BACKOFF_MAX = 600.0
+
+# 收到第一帧数据前实体使用的占位数据
+INITIAL_DATA = {
+    "sch": 0, "loc": 0, "tmd": 0, "tol": 0, "tcm": 0, "tct": 0,
+    "tdm": 0, "tdt": 0, "atm": 0, "trt": 0, "crt": 0, "pwr": 0,
+    "odt": 0, "coe": 0, "ccm": 0, "cct": 0, "cdm": 0, "cdt": 0,
+    "fst": 0, "ovr": 0, "gas": 0.000001,
+}
+
+
+class AirtubDevice:
+    """Runtime state of one configured Airtub Partner."""
+
+    def __init__(
+        self,
+        hass: HomeAssistant,
+        device: str,
+        secret: str,
+        mode: str,
+        command_window: float,
+        on_ready,
+        host=None,
+        journal=False,
+        interfaces=(),
+    ):
+        """Initialize the device."""
+        self.hass = hass
+        self.device = device
+        self.mode = mode
+        self.listener = None
+        self.journal = journal
+        # 加入组播组的本机网卡地址，为空时由内核选择
+        self.interfaces = tuple(interfaces)
+        self.codec = AirtubCodec(secret)
+        self.sender = CommandSender(self.codec)
+        self.coalescer = CommandCoalescer(self.async_send_command, command_window)
+        self.ip = host
+        self.last_heard = None
+        # 平均上报间隔，用于判断数据是否中断
+        self.report_interval = DEFAULT_REPORT_INTERVAL
+        self.stale_since = None
+        self.available = True
+        self.stats = DeviceStats()
+        self.telemetry = Telemetry(INITIAL_DATA)
+        self.history = DeviceHistory()
+        self.metrics = DerivedMetrics()
+        self.status_entity_id = f"{DOMAIN}.{device}_status"
+        # 实体显示的是缓存数据，尚未收到实时数据
+        self.stale = False
+        self.store = Store(hass, STORAGE_VERSION, STORAGE_KEY.format(device))
+        self._save_scheduled = False
+        # 本轮读取中变化与新出现的键，读取结束后统一通知
+        self.notify_pending = False
+        self._changed = set()
+        self._added = []
+        self._ready = False
+        self._on_ready = on_ready
+        # 最近一帧有效数据的CRC及其去重截止时间
+        self._last_crc = None
+        self._dedup_until = 0.0
+
+    async def async_restore(self) -> bool:
+        """Load the last saved snapshot, return True when there was one."""
+        try:
+            cached = await self.store.async_load()
+        except Exception as e:
+            _LOGGER.warning("AIRTUB: Could not load the cached data of %s: %s", self.device, e)
+            return False
+        if not cached or not cached.get("telemetry"):
+            return False
+        self.telemetry = Telemetry({**INITIAL_DATA, **cached["telemetry"]})
+        self.stale = True
+        self._ready = True
+        return True
+
+    @callback
+    def _schedule_save(self):
+        """Save the snapshot at most once per SNAPSHOT_SAVE_DELAY."""
+        if not self._save_scheduled:
+            self._save_scheduled = True
+            self.store.async_delay_save(self.snapshot, SNAPSHOT_SAVE_DELAY)
+
+    @callback
+    def snapshot(self) -> dict:
+        """Return the data to save."""
+        self._save_scheduled = False
+        return {"telemetry": self.telemetry.as_dict()}
+
+    @callback
+    def is_duplicate(self, crc: int) -> bool:
+        """Return True for a repeat of the last accepted frame within DEDUP_WINDOW.
+
+        Only the last accepted frame counts, so a value that changes and
+        changes back (A, B, A) is applied every time, and a frame whose
+        payload was corrupted does not suppress its good copy. Frames are
+        never dropped while a command waits for its ack, as two acks can be
+        byte for byte identical.
+        """
+        if crc != self._last_crc or self.sender.awaiting_ack:
+            return False
+        now = time.monotonic()
+        if now >= self._dedup_until:
+            return False
+        self.last_heard = now
+        self.stats.duplicates += 1
+        return True
+
+    @callback
+    def frame_accepted(self, crc: int):
+        """Remember the CRC of a frame that decoded and belongs to this device."""
+        self._last_crc = crc
+        self._dedup_until = time.monotonic() + DEDUP_WINDOW
+
+    @property
+    def stale_after(self) -> float:
+        """Return how long the device may be silent before it counts as lost."""
+        return max(MIN_STALE_AFTER, STALE_FACTOR * self.report_interval)
+
+    @callback
+    def set_available(self, available: bool):
+        """Mark the entities of this device available or unavailable."""
+        if available != self.available:
+            self.available = available
+            async_dispatcher_send(self.hass, SIGNAL_AVAILABLE.format(self.device), available)
+
+    @callback
+    def set_status(self, state: str, attributes=None):
+        """Set the free-text status of this device."""
+        self.hass.states.async_set(self.status_entity_id, state, attributes)
+
+    @callback
+    def async_process(self, message: dict, addr):
+        """Apply a telemetry frame and remember which keys changed.
+
+        The entities are notified by async_notify once the listener has read
+        every datagram that was waiting.
+        """
+        now = time.monotonic()
+        if self.last_heard is not None:
+            gap = now - self.last_heard
+            if gap < MAX_REPORT_GAP:
+                self.report_interval += REPORT_INTERVAL_GAIN * (gap - self.report_interval)
+        if self.stale_since is not None:
+            self.stats.recoveries += 1
+            self.stats.recovery_time = now - self.stale_since
+            self.stale_since = None
+            _LOGGER.info(
+                "AIRTUB: %s is back after %.0f s", self.device, self.stats.recovery_time
+            )
+            self.set_available(True)
+        self.ip = addr[0]
+        self.last_heard = now
+        self.stats.frames += 1
+        if "rec" in message:
+            del message["rec"]
+            self.sender.ack_received()
+
+        telemetry = self.telemetry
+        changed = telemetry.update(message)
+        full = FULL_FRAME_KEY in message
+        if full:
+            # 只按完整数据帧采样，应答帧不计入历史与派生指标
+            self.history.record(time.time(), telemetry.values)
+            self.metrics.update(now, telemetry.values)
+        if not self._ready:
+            # 首次收到完整数据后才加载实体平台
+            if full:
+                self._ready = True
+                self._schedule_save()
+                self._on_ready()
+            return
+        if changed:
+            self._changed.update(changed)
+            if telemetry.added:
+                self._added.extend(telemetry.added)
+
+    @callback
+    def async_notify(self):
+        """Notify the entities of the keys changed since the last notification."""
+        self.notify_pending = False
+        if not self._ready:
+            return
+        if self._added:
+            async_dispatcher_send(self.hass, SIGNAL_NEW_KEYS.format(self.device), self._added)
+            self._added = []
+        if self.stale:
+            self.stale = False
+            self.set_status("ready")
+            async_dispatcher_send(self.hass, SIGNAL_LIVE.format(self.device))
+        if not self._changed:
+            return
+        self._schedule_save()
+        # 只通知数值发生变化的实体，一轮读取中多次变化的键只通知最终值
+        telemetry = self.telemetry
+        for key in self._changed:
+            async_dispatcher_send(
+                self.hass, SIGNAL_UPDATE.format(self.device, key), telemetry.get(key)
+            )
+        self._changed.clear()
+
+    async def async_send_command(self, command: dict) -> bool:
+        """Send a command to the device and return whether it was acked."""
+        if self.ip is None:
+            return False
+        command.update({"tar": self.device, "dev": DOMAIN, "pwr": 5})
+        try:
+            self.set_status("busy")
+            acked = await self.sender.async_send(command, (self.ip, UDP_PORT))
+            if not acked:
+                _LOGGER.warning("AIRTUB: No acknowledgement for command %s", command)
+            self.set_status("ready", self.sender.link_quality())
+            return acked
+        except (OSError, socket.gaierror) as e:
+            _LOGGER.error("AIRTUB: Error occurred while sending data: %s", e)
+        return False
+
+
+class AirtubListener:
+    """UDP listener shared by every Airtub Partner using the same socket.
+
+    There is one multicast listener bound to all interfaces and joined to the
+    group on every interface its devices chose, plus one unicast listener per
+    local address that devices in "ser" mode send to. Frames are routed to
+    devices by the serial in their "dev" field. Each device has its own
+    secret, so the device last heard from a source address is tried first and
+    the others only when its codec rejects the frame.
+
+    Datagrams are read with recvfrom_into into one preallocated buffer from an
+    event loop reader callback, and parsed straight out of a memoryview of it,
+    so the header, CRC and payload are never copied before decryption. When
+    interfaces were chosen explicitly, recvmsg_into also returns IP_PKTINFO,
+    and commands go out with the same IP_PKTINFO, so they leave through the
+    interface the device was last heard on.
+
+    Each wake-up drains up to MAX_DRAIN waiting datagrams. Every frame is
+    validated and applied to its device's telemetry, but entities are notified
+    once per device at the end of the drain, with the latest value of each key
+    that changed during it.
+    """
+
+    def __init__(self, hass: HomeAssistant, bind_ip: str = "0.0.0.0", multicast: bool = True):
+        """Initialize the listener."""
+        self.hass = hass
+        self.bind_ip = bind_ip
+        self.multicast = multicast
+        self.devices = {}
+        self.journal = None
+        self.stats = ListenerStats()
+        self._by_addr = {}
+        self._unsub_journal = None
+        self._sock = None
+        self.memberships = set()
+        # 每个设备地址最近一次收到数据的 in_pktinfo
+        self._pktinfo = None
+        # 套接字最近一次收到任何数据的时间，用于判断整个监听是否中断
+        self.last_frame = time.monotonic()
+        self._recovery_attempts = 0
+        self._next_recovery = 0.0
+        self._buffer = bytearray(RECV_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        # 本轮读取中收到数据的设备
+        self._notify = []
+        # profile 服务运行期间的 HotPathProfiler
+        self.profiler = None
+
+    async def async_start(self):
+        """Open the socket and start reading from it."""
+        self._open()
+
+    @callback
+    def _open(self):
+        """Create the socket and register the reader."""
+        self._sock = _create_socket(self.bind_ip, UDP_PORT, self.multicast)
+        for interface in self.memberships:
+            self._join(interface)
+        if self._pktinfo is not None:
+            self._sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+        self.hass.loop.add_reader(self._sock.fileno(), self._read_ready)
+
+    @callback
+    def _join(self, interface: str):
+        """Join the group on one interface, logging when it is gone."""
+        try:
+            self._sock.setsockopt(
+                socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, _mreq(UDP_GROUP, interface)
+            )
+        except OSError as e:
+            if e.errno == errno.EADDRINUSE:
+                # 系统默认网卡同时被显式选中时，两个成员关系落在同一块网卡上
+                return
+            _LOGGER.warning("AIRTUB: Could not join %s on %s: %s", UDP_GROUP, interface, e)
+
+    @callback
+    def _update_memberships(self):
+        """Join the group on the interfaces the devices chose and leave the rest."""
+        if not self.multicast:
+            return
+        wanted = set()
+        for device in self.devices.values():
+            # 未选择网卡的设备仍需要系统默认网卡上的成员关系
+            wanted.update(device.interfaces or (ANY_INTERFACE,))
+        wanted = wanted or {ANY_INTERFACE}
+        if self.devices and wanted != self.memberships and self._sock is not None:
+            for interface in self.memberships - wanted:
+                try:
+                    self._sock.setsockopt(
+                        socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, _mreq(UDP_GROUP, interface)
+                    )
+                except OSError:
+                    pass
+            # 退出的成员关系可能与保留的共用一块网卡，全部重新加入
+            for interface in wanted:
+                self._join(interface)
+        self.memberships = wanted
+        explicit = wanted != {ANY_INTERFACE}
+        if explicit != (self._pktinfo is not None):
+            self._pktinfo = {} if explicit else None
+            if self._sock is not None:
+                self._sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, int(explicit))
+
+    @callback
+    def sendto(self, data: bytes, addr):
+        """Send a datagram from this listener's socket."""
+        if self._sock is None:
+            raise OSError("AIRTUB: socket is being rebuilt")
+        pktinfo = self._pktinfo.get(addr[0]) if self._pktinfo is not None else None
+        if pktinfo is None:
+            self._sock.sendto(data, addr)
+        else:
+            # 从最近收到该设备数据的网卡发出
+            self._sock.sendmsg([data], [(socket.IPPROTO_IP, IP_PKTINFO, pktinfo)], 0, addr)
+
+    @callback
+    def recover(self, silent_after: float) -> bool:
+        """Try to get frames flowing again, return True when something was done.
+
+        Nothing is done while the socket received anything within the last
+        silent_after seconds, as a single silent device (switched off, wrong
+        secret) says nothing about the socket its neighbours are heard on.
+        The first attempt only renews the multicast membership, which is what
+        a switch that dropped it needs. Later attempts rebuild the socket.
+        Attempts back off exponentially and the sequence starts over once the
+        socket receives data again.
+        """
+        now = time.monotonic()
+        if now - self.last_frame < silent_after or now < self._next_recovery:
+            return False
+        try:
+            if self._recovery_attempts == 0 and self.multicast and self._sock is not None:
+                _LOGGER.warning("AIRTUB: No data on %s, renewing multicast membership", self.bind_ip)
+                self.stats.rejoins += 1
+                for interface in self.memberships:
+                    _rejoin(self._sock, UDP_GROUP, interface)
+            else:
+                _LOGGER.warning("AIRTUB: No data on %s, rebuilding the socket", self.bind_ip)
+                self.stats.rebuilds += 1
+                self.close()
+                self._open()
+        except OSError as e:
+            _LOGGER.error("AIRTUB: Recovery of %s failed: %s", self.bind_ip, e)
+        self._next_recovery = now + min(
+            RECOVERY_BACKOFF_MAX, RECOVERY_BACKOFF_MIN * 2 ** self._recovery_attempts
+        )
+        self._recovery_attempts += 1
+        return True
+
+    @callback
+    def _read_ready(self):
+        """Handle a readable socket, under the profiler while one is attached."""
+        if self.profiler is None:
+            self._drain()
+        else:
+            self.profiler.call(self._drain)
+
+    @callback
+    def _drain(self):
+        """Drain the waiting datagrams, then notify each device's entities once."""
+        sock = self._sock
+        count = 0
+        try:
+            while count < MAX_DRAIN:
+                try:
+                    if self._pktinfo is None:
+                        size, addr = sock.recvfrom_into(self._buffer)
+                    else:
+                        size, ancdata, _flags, addr = sock.recvmsg_into(
+                            [self._buffer], PKTINFO_SPACE
+                        )
+                        for level, kind, data in ancdata:
+                            if level == socket.IPPROTO_IP and kind == IP_PKTINFO:
+                                self._pktinfo[addr[0]] = data
+                except (BlockingIOError, InterruptedError):
+                    break
+                except OSError as exc:
+                    self.error_received(exc)
+                    break
+                count += 1
+                self.datagram_received(self._view[:size], addr)
+        finally:
+            if count:
+                self.last_frame = time.monotonic()
+                if self._recovery_attempts:
+                    self._recovery_attempts = 0
+                    self._next_recovery = 0.0
+            stats = self.stats
+            stats.drains += 1
+            if count > stats.drain_max:
+                stats.drain_max = count
+            if self._notify:
+                for device in self._notify:
+                    device.async_notify()
+                self._notify.clear()
+
+    @callback
+    def add(self, device: AirtubDevice):
+        """Start routing frames to a device."""
+        self.devices[device.device] = device
+        device.listener = self
+        device.sender.transport = self
+        self._update_journal()
+        self._update_memberships()
+
+    @callback
+    def remove(self, device: AirtubDevice) -> bool:
+        """Stop routing frames to a device, return True when none are left."""
+        self.devices.pop(device.device, None)
+        for addr in [a for a, d in self._by_addr.items() if d is device]:
+            del self._by_addr[addr]
+            if self._pktinfo is not None:
+                self._pktinfo.pop(addr, None)
+        self._update_journal()
+        self._update_memberships()
+        return not self.devices
+
+    @callback
+    def _update_journal(self):
+        """Record raw datagrams while any device on this socket asks for it."""
+        wanted = any(device.journal for device in self.devices.values())
+        if wanted and self.journal is None:
+            self.journal = FrameJournal(
+                self.hass.config.path(JOURNAL_DIR, f"{self.bind_ip}.journal.gz")
+            )
+            self._unsub_journal = async_track_time_interval(
+                self.hass, self._flush_journal, JOURNAL_FLUSH_INTERVAL
+            )
+        elif not wanted and self.journal is not None:
+            self._flush_journal()
+            self._unsub_journal()
+            self._unsub_journal = None
+            self.journal = None
+
+    @callback
+    def _flush_journal(self, _now=None):
+        """Hand the buffered datagrams to the executor for writing."""
+        batch = self.journal.take()
+        if batch:
+            self.hass.async_add_executor_job(self.journal.write, batch)
+
+    @callback
+    def close(self):
+        """Close the socket."""
+        if self._sock is not None:
+            self.hass.loop.remove_reader(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+
+    def datagram_received(self, data: memoryview, addr):
+        """Decode and dispatch a single datagram."""
+        if not data:
+            return
+        if self.journal is not None:
+            self.journal.append(bytes(data), addr)
+        stats = self.stats
+        stats.frames += 1
+        started = time.perf_counter()
+        device = self._by_addr.get(addr[0])
+        crc = HEADER.unpack_from(data)[2] if len(data) >= HEADER.size else None
+        message = None
+        if device is not None:
+            # 解密前丢弃与该设备上一帧有效数据相同的重复帧
+            if device.is_duplicate(crc):
+                return
+            message = device.codec.decode(data)
+        if message is None:
+            for candidate in self.devices.values():
+                message = candidate.codec.decode(data)
+                if message is not None:
+                    break
+            else:
+                self._count_rejected()
+                return
+
+        dev = message.pop("dev", None)
+        device = self.devices.get(dev.lower()) if isinstance(dev, str) else None
+        if device is None:
+            stats.foreign += 1
+            return
+        self._by_addr[addr[0]] = device
+        device.frame_accepted(crc)
+        elapsed = time.perf_counter() - started
+        stats.decoded += 1
+        stats.decode_time += elapsed
+        if elapsed > stats.decode_time_max:
+            stats.decode_time_max = elapsed
+        device.async_process(message, addr)
+        if not device.notify_pending:
+            device.notify_pending = True
+            self._notify.append(device)
+
+    def _count_rejected(self):
+        """Count a frame that none of the devices could decode."""
+        errors = {device.codec.last_error for device in self.devices.values()}
+        if REJECT_CRC in errors:
+            self.stats.crc_errors += 1
+        elif REJECT_JSON in errors:
+            self.stats.json_errors += 1
+        else:
+            # 使用其它密钥加密的数据，来自未配置的设备
+            self.stats.foreign += 1
+
+    def error_received(self, exc):
+        """Log socket errors without stopping the listener."""
+        _LOGGER.error("Socket error: %s", exc)
+
+
+def _create_socket(bind_ip: str, port: int, multicast: bool = False):
+    """Create a non-blocking UDP socket, ready to join the multicast group.
+
+    Unicast sockets are bound to the local address the device sends to, which
+    takes precedence over the wildcard bound multicast socket on the same port.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((bind_ip, port))
+    if multicast:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 10)
+    sock.setblocking(False)
+    return sock
+
+
+def _mreq(multicast_group: str, interface: str = ANY_INTERFACE) -> bytes:
+    """Return the membership request for a group on one interface."""
+    return socket.inet_aton(multicast_group) + socket.inet_aton(interface)
+
+
+def _rejoin(sock, multicast_group: str, interface: str = ANY_INTERFACE):
+    """Drop and add the multicast membership, so a new IGMP report goes out."""
+    mreq = _mreq(multicast_group, interface)
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, mreq)
+    except OSError:
+        pass  # 成员关系可能已随网卡重启失效
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
@@ -0,0 +1,117 @@
+"""Rotating on-disk journal of raw Airtub datagrams."""
+
+import gzip
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+
+# timestamp, source IPv4 address, source port, datagram length
+RECORD = struct.Struct("<d4sHH")
+
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+
+class FrameJournal:
+    """Append raw datagrams to a rotating, gzip compressed journal.
+
+    Records are buffered in memory by append(), which runs on the event loop,
+    and handed to write() in batches, which does the blocking file I/O and is
+    meant to run in an executor. Each batch is written as its own gzip member,
+    so an interrupted write never corrupts earlier records.
+    """
+
+    def __init__(self, path: str, max_bytes: int = MAX_BYTES, backup_count: int = BACKUP_COUNT):
+        """Initialize the journal."""
+        self.path = path
+        self._max_bytes = max_bytes
+        self._backup_count = backup_count
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def append(self, data: bytes, addr):
+        """Buffer one datagram."""
+        self._buffer.append(
+            RECORD.pack(time.time(), socket.inet_aton(addr[0]), addr[1], len(data))
+        )
+        self._buffer.append(data)
+
+    def take(self) -> bytes:
+        """Return and clear the buffered records."""
+        if not self._buffer:
+            return b""
+        batch = b"".join(self._buffer)
+        self._buffer.clear()
+        return batch
+
+    def write(self, batch: bytes):
+        """Write a batch of records to disk, rotating the file when it is full."""
+        if not batch:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with gzip.open(self.path, "ab") as journal:
+                journal.write(batch)
+            if os.path.getsize(self.path) >= self._max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        """Shift journal.N to journal.N+1 and start a new journal."""
+        for index in range(self._backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self._backup_count:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+
+
+class JournalReader:
+    """Iterate over (timestamp, (ip, port), datagram) records of a journal file.
+
+    The file is memory-mapped and decompressed as a stream, so journals of any
+    size can be replayed without reading them into memory first. When the last
+    gzip member was cut short, e.g. Home Assistant was stopped during a write,
+    every complete record is still yielded and truncated is set.
+    """
+
+    def __init__(self, path: str):
+        """Initialize the reader."""
+        self.path = path
+        self.records = 0
+        self.truncated = False
+
+    def __iter__(self):
+        """Yield the records of the journal."""
+        with open(self.path, "rb") as journal_file:
+            if os.fstat(journal_file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(journal_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with gzip.GzipFile(fileobj=mapped, mode="rb") as journal:
+                    while True:
+                        try:
+                            header = journal.read(RECORD.size)
+                            if len(header) < RECORD.size:
+                                self.truncated = bool(header)
+                                return
+                            timestamp, ip, port, length = RECORD.unpack(header)
+                            data = journal.read(length)
+                        except (EOFError, gzip.BadGzipFile, zlib.error):
+                            # 写入中断的最后一个 gzip 成员
+                            self.truncated = True
+                            return
+                        if len(data) < length:
+                            self.truncated = True
+                            return
+                        self.records += 1
+                        yield timestamp, (socket.inet_ntoa(ip), port), data
+
+
+def read_journal(path: str):
+    """Yield (timestamp, (ip, port), datagram) from a journal file."""
+    return iter(JournalReader(path))
@@ -0,0 +1,196 @@
+"""Metrics derived incrementally from the Airtub telemetry stream."""
+
+import math
+import time
+from array import array
+from .telemetry import FIELD_INDEX
+
+GAS, FST, CCM, CDM = (FIELD_INDEX[key] for key in ("gas", "fst", "ccm", "cdm"))
+
+# 平滑燃气流量的时间常数（秒）
+FLOW_EMA_TAU = 300
+# 两帧间隔超过该值（秒）时不计入时长统计，避免把断线时间算作燃烧时间
+MAX_FRAME_GAP = 60
+SLOT_SECONDS = 60
+
+
+class RollingSum:
+    """Sum of the amounts added during the last window seconds.
+
+    Amounts are kept in per-minute slots and the total is adjusted as slots
+    expire, so adding and reading cost O(1) per frame.
+    """
+
+    __slots__ = ("_slots", "_index", "_slot_end", "_total")
+
+    def __init__(self, window: int):
+        """Initialize the sum."""
+        self._slots = array("d", bytes(8 * (window // SLOT_SECONDS)))
+        self._index = 0
+        self._slot_end = None
+        self._total = 0.0
+
+    def add(self, now: float, amount: float):
+        """Add an amount at time now."""
+        self._advance(now)
+        self._slots[self._index] += amount
+        self._total += amount
+
+    def total(self, now: float) -> float:
+        """Return the sum over the window ending at now."""
+        self._advance(now)
+        return self._total
+
+    def _advance(self, now: float):
+        """Expire the slots that fell out of the window."""
+        slot_end = self._slot_end
+        if slot_end is not None and now < slot_end:
+            return
+        slots = self._slots
+        if slot_end is None or now - slot_end >= (len(slots) - 1) * SLOT_SECONDS:
+            # 首次使用或已超过整个窗口
+            for index in range(len(slots)):
+                slots[index] = 0.0
+            self._total = 0.0
+        else:
+            for _ in range(int((now - slot_end) // SLOT_SECONDS) + 1):
+                self._index = (self._index + 1) % len(slots)
+                self._total -= slots[self._index]
+                slots[self._index] = 0.0
+        self._slot_end = now - now % SLOT_SECONDS + SLOT_SECONDS
+
+
+class DerivedMetrics:
+    """Gas flow, burner duty cycle, ignitions and CH/DHW split of one device.
+
+    Each frame is folded in with a constant amount of work. The interval since
+    the previous frame is attributed to the flame and demand state of that
+    previous frame.
+    """
+
+    __slots__ = (
+        "gas_flow",
+        "gas_flow_avg",
+        "_last",
+        "_flame",
+        "_zone",
+        "_gas",
+        "_gas_time",
+        "_observed_15m",
+        "_observed_1h",
+        "_flame_15m",
+        "_flame_1h",
+        "_ignitions_1h",
+        "_ch_1h",
+        "_dhw_1h",
+    )
+
+    def __init__(self):
+        """Initialize the metrics."""
+        self.gas_flow = None
+        self.gas_flow_avg = None
+        self._last = None
+        self._flame = False
+        self._zone = None
+        self._gas = None
+        self._gas_time = None
+        self._observed_15m = RollingSum(900)
+        self._observed_1h = RollingSum(3600)
+        self._flame_15m = RollingSum(900)
+        self._flame_1h = RollingSum(3600)
+        self._ignitions_1h = RollingSum(3600)
+        self._ch_1h = RollingSum(3600)
+        self._dhw_1h = RollingSum(3600)
+
+    def update(self, now: float, values: list):
+        """Fold the telemetry record of a new frame into the metrics.
+
+        now is a time.monotonic() timestamp.
+        """
+        flame = bool(values[FST])
+        last = self._last
+        self._last = now
+        if last is not None:
+            elapsed = now - last
+            if 0 < elapsed <= MAX_FRAME_GAP:
+                self._observed_15m.add(now, elapsed)
+                self._observed_1h.add(now, elapsed)
+                if self._flame:
+                    self._flame_15m.add(now, elapsed)
+                    self._flame_1h.add(now, elapsed)
+                    # 生活热水优先于采暖
+                    if self._zone == CDM:
+                        self._dhw_1h.add(now, elapsed)
+                    elif self._zone == CCM:
+                        self._ch_1h.add(now, elapsed)
+                self._update_flow(now, values[GAS], flame, elapsed)
+            if flame and not self._flame:
+                self._ignitions_1h.add(now, 1)
+        self._flame = flame
+        self._zone = CDM if values[CDM] else CCM if values[CCM] else None
+
+    def _update_flow(self, now: float, gas, flame: bool, elapsed: float):
+        """Update the instant and smoothed gas flow in m³/h."""
+        if not isinstance(gas, (int, float)):
+            return
+        if self._gas is None or gas < self._gas or not flame:
+            # 首次读数、表计归零或熄火：熄火期间不断更新基准，
+            # 点火后的第一次跳变不会被整个熄火时长摊薄
+            self._gas, self._gas_time = gas, now
+        elif gas > self._gas:
+            self.gas_flow = (gas - self._gas) * 3600 / (now - self._gas_time)
+            self._gas, self._gas_time = gas, now
+        if not flame:
+            self.gas_flow = 0.0
+        elif self.gas_flow is None:
+            return
+        if self.gas_flow_avg is None:
+            self.gas_flow_avg = self.gas_flow
+        else:
+            alpha = 1 - math.exp(-elapsed / FLOW_EMA_TAU)
+            self.gas_flow_avg += alpha * (self.gas_flow - self.gas_flow_avg)
+
+    @property
+    def duty_cycle_15m(self):
+        """Return the share of the last 15 minutes the flame was on, in percent."""
+        return _share(self._flame_15m, self._observed_15m, time.monotonic())
+
+    @property
+    def duty_cycle_1h(self):
+        """Return the share of the last hour the flame was on, in percent."""
+        return _share(self._flame_1h, self._observed_1h, time.monotonic())
+
+    @property
+    def ignitions_1h(self):
+        """Return the number of ignitions during the last hour."""
+        return round(self._ignitions_1h.total(time.monotonic()))
+
+    @property
+    def ch_time_1h(self):
+        """Return the burner minutes spent on heating during the last hour."""
+        return round(self._ch_1h.total(time.monotonic()) / 60, 1)
+
+    @property
+    def dhw_time_1h(self):
+        """Return the burner minutes spent on hot water during the last hour."""
+        return round(self._dhw_1h.total(time.monotonic()) / 60, 1)
+
+    def as_dict(self) -> dict:
+        """Return the current metrics."""
+        return {
+            "gas_flow": self.gas_flow,
+            "gas_flow_avg": self.gas_flow_avg,
+            "duty_cycle_15m": self.duty_cycle_15m,
+            "duty_cycle_1h": self.duty_cycle_1h,
+            "ignitions_1h": self.ignitions_1h,
+            "ch_time_1h": self.ch_time_1h,
+            "dhw_time_1h": self.dhw_time_1h,
+        }
+
+
+def _share(part: RollingSum, whole: RollingSum, now: float):
+    """Return part as a percentage of whole, None before any interval was seen."""
+    observed = whole.total(now)
+    if observed <= 0:
+        return None
+    return round(min(part.total(now) / observed, 1.0) * 100, 1)
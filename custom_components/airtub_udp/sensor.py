@@ -3,106 +3,178 @@
 # pylint: disable=broad-except, global-statement, too-many-locals, too-many-statements, too-many-instance-attributes, too-many-arguments, unused-argument, unused-variable, import-error, overridden-final-method
 
 import logging
+import time
 from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.dispatcher import async_dispatcher_connect
+from homeassistant.helpers.event import async_call_later
 from homeassistant.components.sensor import SensorEntity
 from homeassistant.components.binary_sensor import BinarySensorEntity
-from homeassistant.const import UnitOfTemperature, PERCENTAGE
+from homeassistant.const import UnitOfTime, UnitOfVolumeFlowRate, PERCENTAGE, EntityCategory
 from homeassistant.components.sensor import SensorDeviceClass, SensorStateClass
-from .const import DOMAIN, EVENT_NEW_DATA
+from .descriptors import describe
+from .history import HISTORY_ATTRIBUTES
+from .const import (
+    DOMAIN,
+    SIGNAL_AVAILABLE,
+    SIGNAL_LIVE,
+    SIGNAL_NEW_KEYS,
+    SIGNAL_UPDATE,
+    CONF_MIN_INTERVAL,
+    CONF_FLUSH_INTERVAL,
+    DEFAULT_DEADBANDS,
+    DEFAULT_MIN_INTERVAL,
+    DEFAULT_FLUSH_INTERVAL,
+)
 
 _LOGGER = logging.getLogger(__name__)
 
 
 async def async_setup_entry(hass, config_entry, async_add_entities):
     """Set up the sensor platform from a config entry."""
-    device = hass.data[DOMAIN].get("device")
-    if not device:
-        return
-
-    data = hass.data[DOMAIN].get("data", {})
-
-    entities = [
-        UDPMulticastBinarySensor(hass, device, key, value, f"boiler_{device}_{key}")
-        if key.endswith(("m", "fst", "loc", "ovr", "sch", "tmd", "vir"))
-        else UDPMulticastSensor(hass, device, key, value, f"boiler_{device}_{key}")
-        for key, value in data.items()
-    ]
+    airtub = hass.data[DOMAIN][config_entry.entry_id]
+    device = airtub.device
+    options = config_entry.options
+
+    def write_policy(descriptor):
+        """Return (deadband, min interval, flush interval) for a sensor key."""
+        option = descriptor.deadband
+        if option is None:
+            return None
+        return (
+            options.get(option, DEFAULT_DEADBANDS[option]),
+            options.get(CONF_MIN_INTERVAL, DEFAULT_MIN_INTERVAL),
+            options.get(CONF_FLUSH_INTERVAL, DEFAULT_FLUSH_INTERVAL),
+        )
 
-    async_add_entities(entities, update_before_add=True)
+    def create_entity(key, value):
+        """Create the entity of a telemetry key from its descriptor."""
+        descriptor = describe(key)
+        if descriptor.binary:
+            return UDPMulticastBinarySensor(
+                hass, airtub, key, descriptor, value, airtub.stats
+            )
+        return UDPMulticastSensor(
+            hass,
+            airtub,
+            key,
+            descriptor,
+            value,
+            airtub.stats,
+            write_policy(descriptor),
+            airtub.history.keys.get(key),
+        )
 
     @callback
-    def handle_data_changed_event(event):
-        """Handle the custom event and notify all entities."""
-        for entity in entities:
-            entity.handle_event(event)
-
-    hass.bus.async_listen(EVENT_NEW_DATA, handle_data_changed_event)
+    def handle_new_keys(keys):
+        """Add entities for keys the device started to report."""
+        async_add_entities([create_entity(key, airtub.telemetry.get(key)) for key in keys])
+
+    config_entry.async_on_unload(
+        async_dispatcher_connect(hass, SIGNAL_NEW_KEYS.format(device), handle_new_keys)
+    )
+
+    entities = [create_entity(key, value) for key, value in airtub.telemetry.items()]
+    entities.extend(
+        AirtubDiagnosticSensor(airtub, key, unit, getter)
+        for key, unit, getter in DIAGNOSTIC_SENSORS
+    )
+    entities.extend(
+        AirtubMetricSensor(airtub, key, unit, icon, precision)
+        for key, unit, icon, precision in METRIC_SENSORS
+    )
+
+    async_add_entities(entities)
+
+
+def _average_decode_time(airtub):
+    """Return the mean decode time of the frames the listener accepted, in microseconds."""
+    stats = airtub.listener.stats
+    if not stats.decoded:
+        return None
+    return round(stats.decode_time * 1e6 / stats.decoded, 1)
+
+
+def _ack_rtt(airtub):
+    """Return the smoothed ack round-trip time in milliseconds."""
+    srtt = airtub.sender.srtt
+    return None if srtt is None else round(srtt * 1000)
+
+
+# 诊断传感器：键、单位、读取函数
+DIAGNOSTIC_SENSORS = (
+    ("frames_received", None, lambda airtub: airtub.listener.stats.frames),
+    ("frames_foreign", None, lambda airtub: airtub.listener.stats.foreign),
+    ("crc_errors", None, lambda airtub: airtub.listener.stats.crc_errors),
+    ("json_errors", None, lambda airtub: airtub.listener.stats.json_errors),
+    ("decode_time", "µs", _average_decode_time),
+    ("device_frames", None, lambda airtub: airtub.stats.frames),
+    ("duplicate_frames", None, lambda airtub: airtub.stats.duplicates),
+    ("state_writes", None, lambda airtub: airtub.stats.state_writes),
+    ("state_writes_suppressed", None, lambda airtub: airtub.stats.state_writes_suppressed),
+    ("commands_sent", None, lambda airtub: airtub.sender.commands),
+    ("retransmits", None, lambda airtub: airtub.sender.retransmits),
+    ("acks", None, lambda airtub: airtub.sender.acks),
+    ("ack_rtt", UnitOfTime.MILLISECONDS, _ack_rtt),
+    ("multicast_rejoins", None, lambda airtub: airtub.listener.stats.rejoins),
+    ("socket_rebuilds", None, lambda airtub: airtub.listener.stats.rebuilds),
+    ("drain_max", None, lambda airtub: airtub.listener.stats.drain_max),
+    ("recoveries", None, lambda airtub: airtub.stats.recoveries),
+    ("recovery_time", UnitOfTime.SECONDS, lambda airtub: round(airtub.stats.recovery_time, 1)),
+)
+
+# 派生指标传感器：键、单位、图标、精度
+METRIC_SENSORS = (
+    ("gas_flow", UnitOfVolumeFlowRate.CUBIC_METERS_PER_HOUR, "mdi:meter-gas", 3),
+    ("gas_flow_avg", UnitOfVolumeFlowRate.CUBIC_METERS_PER_HOUR, "mdi:meter-gas", 3),
+    ("duty_cycle_15m", PERCENTAGE, "mdi:fire", 1),
+    ("duty_cycle_1h", PERCENTAGE, "mdi:fire", 1),
+    ("ignitions_1h", None, "mdi:fire-alert", 0),
+    ("ch_time_1h", UnitOfTime.MINUTES, "mdi:radiator", 1),
+    ("dhw_time_1h", UnitOfTime.MINUTES, "mdi:shower", 1),
+)
 
 
 class UDPMulticastSensor(SensorEntity):
     """Representation of a UDP Multicast sensor."""
 
+    _attr_should_poll = False
+    _unrecorded_attributes = HISTORY_ATTRIBUTES
+
     def __init__(
         self,
         hass: HomeAssistant,
-        device: str,
+        airtub,
         key: str,
-        initial_value: str,
-        entity_id: str,
+        descriptor,
+        initial_value,
+        stats,
+        write_policy=None,
+        history=None,
     ):
         """Initialize the sensor."""
         self._hass = hass
-        self._device = device
+        self._airtub = airtub
+        self._device = airtub.device
+        self._stats = stats
         self._key = key
-        self._name = f"boiler_{device}_{key}"
-        self._state = self._convert_to_number(initial_value)
-        self._entity_id = entity_id
-        self._setup_attributes(key)
-
-    def _setup_attributes(self, key):
-        """Setup sensor attributes based on key."""
-        if key in ["cct", "cdt", "tct", "tdt", "odt"]:
-            self._attr_unit_of_measurement = UnitOfTemperature.CELSIUS
-            self._attr_icon = "mdi:thermometer"
-            self._attr_device_class = SensorDeviceClass.TEMPERATURE
-            self._attr_state_class = "measurement"
-            self._attr_precision = 0  # 温度精度为0
-        elif key in ["trt", "crt"]:
-            self._attr_unit_of_measurement = UnitOfTemperature.CELSIUS
-            self._attr_icon = "mdi:thermometer"
-            self._attr_device_class = SensorDeviceClass.TEMPERATURE
-            self._attr_state_class = "measurement"
-            self._attr_precision = 1  # 温度精度为1
-        elif key in ["mod"]:
-            self._attr_unit_of_measurement = PERCENTAGE
-            self._attr_icon = "mdi:percent-box"
-            self._attr_device_class = None
-            self._attr_state_class = "measurement"
-            self._attr_precision = 0  # 百分比精度为0
-        elif key in ["gas"]:
-            self._attr_unit_of_measurement = "m³"
-            self._attr_icon = "mdi:meter-gas"
-            self._attr_device_class = SensorDeviceClass.GAS
-            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
-            self._attr_precision = 6  # 小数点后6位
-        elif key in ["flt"]:
-            self._attr_unit_of_measurement = None
-            self._attr_icon = "mdi:alert-octagram"
-            self._attr_device_class = None
-            self._attr_state_class = None
-            self._attr_precision = None
-        elif key in ["pwr"]:
-            self._attr_unit_of_measurement = None
-            self._attr_icon = "mdi:battery"
-            self._attr_device_class = None
-            self._attr_state_class = "measurement"
-            self._attr_precision = 0 # 默认京都为0
-        else:
-            self._attr_unit_of_measurement = None
-            self._attr_icon = "mdi:numeric"
-            self._attr_device_class = None
-            self._attr_state_class = "measurement"
-            self._attr_precision = 0  # 默认精度为0
+        self._descriptor = descriptor
+        self._name = f"boiler_{self._device}_{key}"
+        self._entity_id = f"boiler_{self._device}_{key}"
+        self._attr_unit_of_measurement = descriptor.unit
+        self._attr_icon = descriptor.icon
+        self._attr_device_class = descriptor.device_class
+        self._attr_state_class = descriptor.state_class
+        # 数值与格式化后的状态，只在数值变化时格式化
+        self._value = self._convert_to_number(initial_value)
+        self._state = descriptor.format(self._value)
+        # 死区、最小写入间隔与强制刷新间隔，None 表示每次变化都立即写入
+        self._write_policy = write_policy
+        # 最近的1分钟与15分钟汇总，作为状态属性
+        self._history = history
+        self._pending = None
+        self._last_write = 0.0
+        self._flush_at = None
+        self._unsub_flush = None
 
     @property
     def name(self):
@@ -112,44 +184,25 @@ class UDPMulticastSensor(SensorEntity):
     @property
     def state(self):
         """Return the state of the sensor."""
-        if self._key == "flt":
-            # 将状态值转换为整数
-            int_state = int(self._state)
-            if int_state == 0:
-                return "off"
-            # 将整数值转换为字符串并确保至少有2位数字
-            str_state = f"E{int_state:02}"
-            return str_state
-        return (
-            round(self._state, self._attr_precision)
-            if self._attr_precision is not None
-            else self._state
-        )
+        return self._state
 
     @property
     def unique_id(self):
         """Return a unique ID."""
         return self._entity_id
 
-    @property
-    def icon(self):
-        return self._attr_icon
-
-    @property
-    def device_class(self):
-        """Return the device class of the sensor."""
-        return self._attr_device_class
-
-    @property
-    def state_class(self):
-        """Return the state class of the sensor."""
-        return self._attr_state_class
-
     @property
     def unit_of_measurement(self):
         """Return the unit of measurement."""
         return self._attr_unit_of_measurement
 
+    @property
+    def extra_state_attributes(self):
+        """Return the last complete rollups of this key."""
+        if self._history is None:
+            return None
+        return self._history.attributes()
+
     @staticmethod
     def _convert_to_number(value):
         """Convert value to number if possible."""
@@ -160,50 +213,143 @@ class UDPMulticastSensor(SensorEntity):
         except ValueError:
             return 0
 
-    def handle_event(self, event):
-        """Handle the custom event and update state."""
-        self.async_schedule_update_ha_state(True)
+    async def async_added_to_hass(self):
+        """Subscribe to changes of this sensor's key."""
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, SIGNAL_UPDATE.format(self._device, self._key), self.handle_update
+            )
+        )
+        self.async_on_remove(self._cancel_flush)
 
-    async def async_update(self):
-        """Fetch new state data for the sensor."""
-        data = self._hass.data[DOMAIN].get("data", {})
-        if self._key in data:
-            new_value = data[self._key]
-            new_value_converted = self._convert_to_number(new_value)
-            if new_value_converted != self._state:
-                self._state = new_value_converted
-                self.async_write_ha_state()
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, SIGNAL_AVAILABLE.format(self._device), self.handle_available
+            )
+        )
+        if self._airtub.stale:
+            self.async_on_remove(
+                async_dispatcher_connect(
+                    self.hass, SIGNAL_LIVE.format(self._device), self.handle_live
+                )
+            )
+        # 创建实体到订阅之间发出的变化不会再通知，订阅后重新读取一次
+        value = self._convert_to_number(self._airtub.telemetry.get(self._key))
+        if value != self._value:
+            self._write_state(value)
+
+    @property
+    def assumed_state(self):
+        """Return True while the entity shows cached data."""
+        return self._airtub.stale
+
+    @callback
+    def handle_live(self):
+        """Write the state again once live data arrives."""
+        self.async_write_ha_state()
+
+    @callback
+    def handle_available(self, available):
+        """Follow the availability of the device."""
+        self._attr_available = available
+        self.async_write_ha_state()
+
+    @callback
+    def handle_update(self, value):
+        """Handle a changed value for this sensor's key."""
+        new_value_converted = self._convert_to_number(value)
+        if new_value_converted == self._value:
+            self._pending = None
+            self._cancel_flush()
+            return
+        if self._write_policy is None:
+            self._write_state(new_value_converted)
+            return
+
+        deadband, min_interval, flush_interval = self._write_policy
+        now = time.monotonic()
+        if abs(new_value_converted - self._value) < deadband:
+            # 死区内的抖动，最迟在强制刷新时写入，保证长期统计正确
+            self._pending = new_value_converted
+            self._stats.state_writes_suppressed += 1
+            self._schedule_flush(self._last_write + flush_interval, now)
+        elif now - self._last_write < min_interval:
+            self._pending = new_value_converted
+            self._stats.state_writes_suppressed += 1
+            self._schedule_flush(self._last_write + min_interval, now)
+        else:
+            self._write_state(new_value_converted)
+
+    @callback
+    def _write_state(self, value):
+        """Write a new state and reset the rate limiting."""
+        self._cancel_flush()
+        self._pending = None
+        self._value = value
+        self._state = self._descriptor.format(value)
+        self._last_write = time.monotonic()
+        self._stats.state_writes += 1
+        self.async_write_ha_state()
+
+    @callback
+    def _schedule_flush(self, flush_at, now):
+        """Make sure the pending value is written no later than flush_at."""
+        if self._flush_at is not None and self._flush_at <= flush_at:
+            return
+        self._cancel_flush()
+        self._flush_at = flush_at
+        self._unsub_flush = async_call_later(
+            self.hass, max(flush_at - now, 0), self._flush
+        )
+
+    @callback
+    def _flush(self, _now):
+        """Write the value held back by the deadband or rate limit."""
+        self._unsub_flush = None
+        self._flush_at = None
+        if self._pending is not None:
+            self._write_state(self._pending)
+
+    @callback
+    def _cancel_flush(self):
+        """Cancel a scheduled flush."""
+        if self._unsub_flush is not None:
+            self._unsub_flush()
+            self._unsub_flush = None
+        self._flush_at = None
 
 
 class UDPMulticastBinarySensor(BinarySensorEntity):
     """Representation of a UDP Multicast binary sensor."""
 
+    _attr_should_poll = False
+
     def __init__(
         self,
         hass: HomeAssistant,
-        device: str,
+        airtub,
         key: str,
-        initial_value: str,
-        entity_id: str,
+        descriptor,
+        initial_value,
+        stats,
     ):
         """Initialize the binary sensor."""
         self._hass = hass
-        self._device = device
+        self._airtub = airtub
+        self._device = airtub.device
+        self._stats = stats
         self._key = key
-        self._name = f"boiler_{device}_{key}"
+        self._name = f"boiler_{self._device}_{key}"
         self._state = self._convert_to_boolean(initial_value)
-        self._entity_id = entity_id
-        self._attr_icon = "mdi:toggle-switch-variant"
+        self._entity_id = f"boiler_{self._device}_{key}"
+        self._attr_icon = descriptor.icon
+        self._attr_device_class = descriptor.device_class
 
     @property
     def name(self):
         """Return the name of the sensor."""
         return self._name
 
-    @property
-    def icon(self):
-        return self._attr_icon
-
     @property
     def is_on(self):
         """Return true if the binary sensor is on."""
@@ -214,26 +360,111 @@ class UDPMulticastBinarySensor(BinarySensorEntity):
         """Return a unique ID."""
         return self._entity_id
 
-    @property
-    def device_class(self):
-        """Return the device class of the binary sensor."""
-        return "opening"
-
     @staticmethod
     def _convert_to_boolean(value):
         """Convert value to boolean."""
         return value == 1
 
-    def handle_event(self, event):
-        """Handle the custom event and update state."""
-        self.async_schedule_update_ha_state(True)
-
-    async def async_update(self):
-        """Fetch new state data for the binary sensor."""
-        data = self._hass.data[DOMAIN].get("data", {})
-        if self._key in data:
-            new_value = data[self._key]
-            new_value_converted = self._convert_to_boolean(new_value)
-            if new_value_converted != self._state:
-                self._state = new_value_converted
-                self.async_write_ha_state()
+    async def async_added_to_hass(self):
+        """Subscribe to changes of this binary sensor's key."""
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, SIGNAL_UPDATE.format(self._device, self._key), self.handle_update
+            )
+        )
+
+        self.async_on_remove(
+            async_dispatcher_connect(
+                self.hass, SIGNAL_AVAILABLE.format(self._device), self.handle_available
+            )
+        )
+        if self._airtub.stale:
+            self.async_on_remove(
+                async_dispatcher_connect(
+                    self.hass, SIGNAL_LIVE.format(self._device), self.handle_live
+                )
+            )
+        # 创建实体到订阅之间发出的变化不会再通知，订阅后重新读取一次
+        self.handle_update(self._airtub.telemetry.get(self._key))
+
+    @property
+    def assumed_state(self):
+        """Return True while the entity shows cached data."""
+        return self._airtub.stale
+
+    @callback
+    def handle_live(self):
+        """Write the state again once live data arrives."""
+        self.async_write_ha_state()
+
+    @callback
+    def handle_available(self, available):
+        """Follow the availability of the device."""
+        self._attr_available = available
+        self.async_write_ha_state()
+
+    @callback
+    def handle_update(self, value):
+        """Handle a changed value for this binary sensor's key."""
+        new_value_converted = self._convert_to_boolean(value)
+        if new_value_converted != self._state:
+            self._state = new_value_converted
+            self._stats.state_writes += 1
+            self.async_write_ha_state()
+
+
+class AirtubDiagnosticSensor(SensorEntity):
+    """Runtime counter of the listener, the device or its command sender."""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
+    _attr_icon = "mdi:counter"
+
+    def __init__(self, airtub, key, unit, getter):
+        """Initialize the diagnostic sensor."""
+        self._airtub = airtub
+        self._getter = getter
+        self._attr_name = f"boiler_{airtub.device}_{key}"
+        self._attr_unique_id = f"boiler_{airtub.device}_diag_{key}"
+        self._attr_native_unit_of_measurement = unit
+        if unit is None:
+            self._attr_state_class = SensorStateClass.TOTAL_INCREASING
+        else:
+            self._attr_state_class = SensorStateClass.MEASUREMENT
+
+    @property
+    def native_value(self):
+        """Return the current counter value."""
+        return self._getter(self._airtub)
+
+
+class AirtubMetricSensor(SensorEntity):
+    """Metric derived from the telemetry stream, such as gas flow or duty cycle."""
+
+    _attr_state_class = SensorStateClass.MEASUREMENT
+
+    def __init__(self, airtub, key, unit, icon, precision):
+        """Initialize the metric sensor."""
+        self._airtub = airtub
+        self._metrics = airtub.metrics
+        self._key = key
+        self._attr_name = f"boiler_{airtub.device}_{key}"
+        self._attr_unique_id = f"boiler_{airtub.device}_metric_{key}"
+        self._attr_native_unit_of_measurement = unit
+        self._attr_icon = icon
+        self._attr_suggested_display_precision = precision
+        if unit == UnitOfVolumeFlowRate.CUBIC_METERS_PER_HOUR:
+            self._attr_device_class = SensorDeviceClass.VOLUME_FLOW_RATE
+        elif unit == UnitOfTime.MINUTES:
+            self._attr_device_class = SensorDeviceClass.DURATION
+
+    @property
+    def available(self):
+        """Return False while the device is not heard from."""
+        return self._airtub.available
+
+    @property
+    def native_value(self):
+        """Return the current value of the metric."""
+        value = getattr(self._metrics, self._key)
+        return None if value is None else round(value, 3)
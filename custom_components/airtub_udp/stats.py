@@ -0,0 +1,48 @@
+"""Runtime counters of the Airtub listener and devices."""
+
+
+class _Stats:
+    """Fixed set of counters updated in place on the packet path."""
+
+    __slots__ = ()
+
+    def __init__(self):
+        """Initialize all counters to zero."""
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def as_dict(self) -> dict:
+        """Return the counters."""
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class ListenerStats(_Stats):
+    """Counters of one UDP listener, shared by the devices it serves."""
+
+    __slots__ = (
+        "frames",
+        "foreign",
+        "crc_errors",
+        "json_errors",
+        # 成功解码并路由到设备的帧数，平均解码时间按此计算
+        "decoded",
+        "decode_time",
+        "decode_time_max",
+        "rejoins",
+        "rebuilds",
+        "drains",
+        "drain_max",
+    )
+
+
+class DeviceStats(_Stats):
+    """Counters of one configured device."""
+
+    __slots__ = (
+        "frames",
+        "duplicates",
+        "state_writes",
+        "state_writes_suppressed",
+        "recoveries",
+        "recovery_time",
+    )
@@ -0,0 +1,98 @@
+"""Fixed layout telemetry record of an Airtub Partner."""
+
+# Known keys, each stored at a fixed index of Telemetry.values
+FIELDS = (
+    "crt", "trt", "cct", "tct", "cdt", "tdt", "odt", "gas", "mod", "flt",
+    "fst", "pwr", "atm", "tcm", "tdm", "ccm", "cdm", "sch", "loc", "tmd",
+    "tol", "coe", "ovr", "vir", "tdf",
+)
+FIELD_INDEX = {key: index for index, key in enumerate(FIELDS)}
+
+# Only full telemetry frames carry crt; acks and other partial frames do not
+FULL_FRAME_KEY = "crt"
+# Keys a full frame omits while they are at their idle value
+FRAME_DEFAULTS = {"mod": 0, "flt": 0, "pwr": 0, "sch": 0, "tmd": 0, "tol": 4}
+_DEFAULTS = tuple((key, FIELD_INDEX[key], value) for key, value in FRAME_DEFAULTS.items())
+
+GAS = FIELD_INDEX["gas"]
+# A zero meter reading is replaced so the TOTAL_INCREASING sensor never resets
+GAS_MIN = 0.000001
+
+
+class Telemetry:
+    """Latest telemetry of one device, updated in place frame by frame.
+
+    Known keys live in a list at the index FIELD_INDEX gives them, so entities
+    can bind to an index once and read it without hashing. Keys the layout
+    does not know yet go to the overflow dict. None means never reported.
+    """
+
+    __slots__ = ("values", "overflow", "changed", "added")
+
+    def __init__(self, initial=None):
+        """Initialize the record."""
+        self.values = [None] * len(FIELDS)
+        self.overflow = {}
+        self.changed = []
+        # 本帧首次出现的键
+        self.added = []
+        if initial:
+            self.update(initial)
+            self.changed.clear()
+            self.added.clear()
+
+    def update(self, message: dict) -> list:
+        """Apply a decoded frame and return the keys whose value changed.
+
+        The returned list is reused by the next update. Keys reported for the
+        first time are also listed in added. Keys left out of a full frame are
+        reset to their idle value, a partial frame only updates its own keys.
+        """
+        values = self.values
+        changed = self.changed
+        changed.clear()
+        if self.added:
+            self.added.clear()
+        for key, value in message.items():
+            index = FIELD_INDEX.get(key)
+            if index is None:
+                if key not in self.overflow:
+                    self.added.append(key)
+                elif self.overflow[key] == value:
+                    continue
+                self.overflow[key] = value
+                changed.append(key)
+                continue
+            if index == GAS and value == 0:
+                value = GAS_MIN
+            if values[index] != value:
+                if values[index] is None:
+                    self.added.append(key)
+                values[index] = value
+                changed.append(key)
+        if FULL_FRAME_KEY not in message:
+            return changed
+        for key, index, value in _DEFAULTS:
+            if key not in message and values[index] != value:
+                if values[index] is None:
+                    self.added.append(key)
+                values[index] = value
+                changed.append(key)
+        return changed
+
+    def get(self, key: str, default=None):
+        """Return the value of a key, or default when it was never reported."""
+        index = FIELD_INDEX.get(key)
+        value = self.overflow.get(key) if index is None else self.values[index]
+        return default if value is None else value
+
+    def items(self):
+        """Yield (key, value) for every key reported so far."""
+        for key, value in zip(FIELDS, self.values):
+            if value is not None:
+                yield key, value
+        yield from self.overflow.items()
+
+    def as_dict(self) -> dict:
+        """Return the record as a plain dict."""
+        return dict(self.items())
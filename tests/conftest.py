@@ -0,0 +1,95 @@
+"""Fixtures returning the modules of the integration.
+
+hub.py needs Home Assistant, which is not a test dependency, so the few names
+it imports are registered as minimal stand-ins before it is loaded.
+"""
+
+import os
+import sys
+import types
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+
+from _component import load  # noqa: E402  pylint: disable=wrong-import-position
+
+
+@pytest.fixture(scope="session")
+def codec():
+    """Return the codec module."""
+    return load("codec")
+
+
+@pytest.fixture(scope="session")
+def telemetry():
+    """Return the telemetry module."""
+    return load("telemetry")
+
+
+@pytest.fixture(scope="session")
+def command():
+    """Return the command module."""
+    return load("command")
+
+
+@pytest.fixture(scope="session")
+def journal():
+    """Return the journal module."""
+    return load("journal")
+
+
+@pytest.fixture(scope="session")
+def metrics():
+    """Return the metrics module."""
+    return load("metrics")
+
+
+class _Store:
+    """In-memory stand-in for homeassistant.helpers.storage.Store."""
+
+    def __init__(self, hass, version, key):
+        """Initialize the store."""
+        self.data = None
+
+    async def async_load(self):
+        """Return the saved data."""
+        return self.data
+
+    def async_delay_save(self, data_func, delay=0):
+        """Save the data, immediately."""
+        self.data = data_func()
+
+
+def _stub_homeassistant():
+    """Register the Home Assistant modules hub.py imports."""
+    names = {
+        "homeassistant": {},
+        "homeassistant.core": {"HomeAssistant": object, "callback": lambda func: func},
+        "homeassistant.helpers": {},
+        "homeassistant.helpers.dispatcher": {"async_dispatcher_send": lambda hass, signal, *args: None},
+        "homeassistant.helpers.event": {"async_track_time_interval": lambda hass, action, interval: lambda: None},
+        "homeassistant.helpers.storage": {"Store": _Store},
+    }
+    for name, attributes in names.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+@pytest.fixture(scope="session")
+def hub():
+    """Return the hub module, on top of the Home Assistant stand-ins."""
+    _stub_homeassistant()
+    return load("hub")
+
+
+@pytest.fixture
+def hass():
+    """Return the parts of a Home Assistant instance the hub uses."""
+    return types.SimpleNamespace(
+        loop=types.SimpleNamespace(add_reader=lambda fd, func: None, remove_reader=lambda fd: None),
+        states=types.SimpleNamespace(async_set=lambda entity_id, state, attributes=None: None),
+        config=types.SimpleNamespace(path=os.path.join),
+        async_add_executor_job=lambda func, *args: None,
+    )
@@ -0,0 +1,115 @@
+"""Known-good vectors and decode throughput of AirtubCodec."""
+
+import binascii
+import json
+import struct
+import time
+import zlib
+from itertools import cycle
+
+import pytest
+
+# (secret, msgtype, JSON payload, frame) produced by the original pack_data
+VECTORS = [
+    (
+        "12345678",
+        1,
+        '{"dev":"abc123","crt":21.5,"trt":22,"mod":35,"fst":1,"gas":123.456}',
+        "01430000adc3b7604a10575143140d1a505050050705151413514140170c05091f071f16"
+        "4144431a0b000118175b585c130800011914514b4510090519145059421009050705190c"
+        "04044e",
+    ),
+    (
+        "s3cr3t",
+        4,
+        '{"trt":22,"tar":"abc123","dev":"airtub_udp","pwr":5}',
+        "04340000aeaa5bb70811170047564901515e11001241414811151150524000565f110717"
+        "45564911021b410006513c075704511f410244065109560f",
+    ),
+    # CRC 0x08418509：原实现用 hex() 比较时会丢掉前导 0 而误判为 CRC 错误
+    (
+        "12345678",
+        1,
+        '{"dev":"abc123","crt":20.1,"rec":1}',
+        "01230000098541084a10575143140d1a505050050705151413514140170c05081f031f16"
+        "4753541a0b034e",
+    ),
+]
+
+BENCH_FRAMES = 20000
+
+
+def xor_crypt(a: str, b: str):
+    """XOR encode/decode, as originally implemented."""
+    return "".join(chr(ord(x) ^ ord(y)) for x, y in zip(a, cycle(b)))
+
+
+def unpack_data(data: bytes, secret: str):
+    """Decode data received from UDP, as originally implemented."""
+    msgtype, datalen = struct.unpack("BB2x", data[:4])
+    crc1 = binascii.hexlify(data[4:8][::-1]).decode()
+    realdata = data[8 : datalen + 8]
+    crc2 = hex(zlib.crc32(realdata))[2:]
+    realdata = xor_crypt(realdata.decode("ascii"), secret).encode("ascii")
+    return msgtype, datalen, realdata, crc1, crc2
+
+
+@pytest.mark.parametrize(("secret", "msgtype", "payload", "frame"), VECTORS)
+def test_pack_matches_original(codec, secret, msgtype, payload, frame):
+    """pack produces the same bytes as the original pack_data."""
+    assert codec.AirtubCodec(secret).pack(msgtype, payload.encode("ascii")).hex() == frame
+
+
+@pytest.mark.parametrize(("secret", "msgtype", "payload", "frame"), VECTORS)
+def test_decode_vectors(codec, secret, msgtype, payload, frame):
+    """unpack and decode recover the payload, including a CRC with a leading 0."""
+    airtub = codec.AirtubCodec(secret)
+    data = bytes.fromhex(frame)
+    assert airtub.unpack(data) == (msgtype, payload.encode("ascii"))
+    assert airtub.unpack(memoryview(data)) == (msgtype, payload.encode("ascii"))
+    assert airtub.decode(data) == json.loads(payload)
+
+
+def test_leading_zero_crc_rejected_by_original():
+    """The original string comparison dropped frames whose CRC starts with 0."""
+    secret, _, _, frame = VECTORS[2]
+    _, _, _, crc1, crc2 = unpack_data(bytes.fromhex(frame), secret)
+    assert crc1 != crc2
+
+
+def test_decode_rejects_corruption(codec):
+    """Bad CRCs, truncated frames and other secrets are rejected."""
+    secret, _, _, frame = VECTORS[0]
+    airtub = codec.AirtubCodec(secret)
+    data = bytearray.fromhex(frame)
+    data[4] ^= 0x01
+    assert airtub.decode(bytes(data)) is None
+    assert airtub.last_error == codec.REJECT_CRC
+    assert airtub.decode(bytes.fromhex(frame)[:20]) is None
+    assert codec.AirtubCodec("other").decode(bytes.fromhex(frame)) is None
+
+
+def _frames_per_second(decode, frames):
+    """Return how many frames per second decode handles."""
+    started = time.perf_counter()
+    for data in frames:
+        decode(data)
+    return len(frames) / (time.perf_counter() - started)
+
+
+def test_decode_throughput(codec):
+    """Compare the original unpack_data path with AirtubCodec.decode."""
+    secret, _, _, frame = VECTORS[0]
+    frames = [bytes.fromhex(frame)] * BENCH_FRAMES
+    airtub = codec.AirtubCodec(secret)
+
+    def original(data):
+        _, _, realdata, crc1, crc2 = unpack_data(data, secret)
+        if crc1 == crc2:
+            return json.loads(realdata)
+        return None
+
+    before = _frames_per_second(original, frames)
+    after = _frames_per_second(airtub.decode, frames)
+    print(f"\ndecode: {before:,.0f} frames/s before, {after:,.0f} frames/s after")
+    assert after > before
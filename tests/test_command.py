@@ -0,0 +1,73 @@
+"""Ack handling of the command sender."""
+
+import asyncio
+
+ADDR = ("127.0.0.1", 4211)
+
+
+class FakeTransport:
+    """Record the datagrams sent and run a callback after each one."""
+
+    def __init__(self):
+        """Initialize the transport."""
+        self.sent = []
+        self.on_send = None
+
+    def sendto(self, data, addr):
+        """Record a datagram."""
+        self.sent.append(data)
+        if self.on_send is not None:
+            self.on_send(len(self.sent))
+
+
+def _sender(codec, command):
+    """Return a sender with a short retransmission timeout."""
+    sender = command.CommandSender(codec.AirtubCodec("12345678"))
+    sender.transport = FakeTransport()
+    sender.rto = 0.05
+    return sender
+
+
+def test_ack_completes_command(codec, command):
+    """An ack to the first transmission completes the command and samples the RTT."""
+
+    async def run():
+        sender = _sender(codec, command)
+        loop = asyncio.get_running_loop()
+        sender.transport.on_send = lambda count: loop.call_later(0.01, sender.ack_received)
+        assert await sender.async_send({"trt": 22}, ADDR)
+        return sender
+
+    sender = asyncio.run(run())
+    assert len(sender.transport.sent) == 1
+    assert sender.last_rtt is not None and sender.last_rtt > 0.005
+
+
+def test_late_duplicate_ack_does_not_ack_next_command(codec, command):
+    """The second ack of a retransmitted command is not taken for the next one's."""
+
+    async def run():
+        sender = _sender(codec, command)
+        loop = asyncio.get_running_loop()
+
+        def on_send(count):
+            if count == 2:
+                # 第一次发送的应答在重发之后才到达，随后是重发的应答
+                sender.ack_received()
+                loop.call_later(0.02, sender.ack_received)
+
+        sender.transport.on_send = on_send
+        assert await sender.async_send({"trt": 22}, ADDR)
+        rtt = sender.last_rtt
+        sender.transport.on_send = lambda count: loop.call_later(0.04, sender.ack_received)
+        second = asyncio.create_task(sender.async_send({"tdt": 45}, ADDR))
+        await asyncio.sleep(0.03)
+        # 多余应答已到达，第二条命令仍在等待自己的应答
+        assert not second.done()
+        assert await second
+        return sender, rtt
+
+    sender, rtt = asyncio.run(run())
+    assert rtt is None
+    assert sender.stray_acks == 1
+    assert sender.last_rtt > 0.03
@@ -0,0 +1,63 @@
+"""Duplicate suppression in AirtubListener.datagram_received."""
+
+import json
+
+import pytest
+
+SECRET = "12345678"
+SERIAL = "abc123"
+ADDR = ("192.0.2.10", 4211)
+
+
+@pytest.fixture
+def listener(hub, hass):
+    """Return a listener with one registered device."""
+    listener = hub.AirtubListener(hass, "127.0.0.1", multicast=False)
+    listener.add(hub.AirtubDevice(hass, SERIAL, SECRET, "unicast", 0.1, lambda: None))
+    return listener
+
+
+def _frame(codec, **values):
+    """Return an encoded full frame of the device."""
+    payload = json.dumps({"dev": SERIAL, "crt": 20.5, **values}, separators=(",", ":"))
+    return codec.AirtubCodec(SECRET).pack(1, payload.encode("ascii"))
+
+
+def _receive(listener, data):
+    """Hand one datagram to the listener."""
+    listener.datagram_received(memoryview(data), ADDR)
+
+
+def test_repeated_frame_is_dropped(codec, listener):
+    """A frame sent twice in a row is applied once."""
+    device = listener.devices[SERIAL]
+    data = _frame(codec, fst=1)
+    _receive(listener, data)
+    _receive(listener, data)
+    assert device.stats.frames == 1
+    assert device.stats.duplicates == 1
+
+
+def test_value_changing_back_is_applied(codec, listener):
+    """A, B, A applies the second A, as only the last accepted frame counts."""
+    device = listener.devices[SERIAL]
+    _receive(listener, _frame(codec, mod=20))  # 记住设备的来源地址
+    for flame in (1, 0, 1):
+        _receive(listener, _frame(codec, fst=flame))
+    assert device.stats.frames == 4
+    assert device.stats.duplicates == 0
+    assert device.telemetry.get("fst") == 1
+
+
+def test_good_copy_of_corrupted_frame_is_applied(codec, listener):
+    """A payload corrupted behind an intact header does not suppress its good copy."""
+    device = listener.devices[SERIAL]
+    _receive(listener, _frame(codec, fst=0))
+    good = _frame(codec, fst=1)
+    corrupted = bytearray(good)
+    corrupted[-1] ^= 0x01
+    _receive(listener, bytes(corrupted))
+    _receive(listener, good)
+    assert listener.stats.crc_errors == 1
+    assert device.stats.duplicates == 0
+    assert device.telemetry.get("fst") == 1
@@ -0,0 +1,38 @@
+"""Reading journals, including one cut short during a write."""
+
+import os
+
+BATCHES = 3
+RECORDS = 50
+
+
+def _write(journal, path):
+    """Write BATCHES gzip members of RECORDS datagrams each."""
+    writer = journal.FrameJournal(str(path))
+    for batch in range(BATCHES):
+        for index in range(RECORDS):
+            writer.append(b"frame %d/%d" % (batch, index), ("10.0.0.2", 4211))
+        writer.write(writer.take())
+
+
+def test_read_complete_journal(journal, tmp_path):
+    """Every record is read back with its source address."""
+    path = tmp_path / "0.0.0.0.journal.gz"
+    _write(journal, path)
+    reader = journal.JournalReader(str(path))
+    records = list(reader)
+    assert len(records) == BATCHES * RECORDS
+    assert records[0][1:] == (("10.0.0.2", 4211), b"frame 0/0")
+    assert not reader.truncated
+
+
+def test_read_truncated_journal(journal, tmp_path):
+    """A journal cut in its last member yields the complete records and flags it."""
+    path = tmp_path / "0.0.0.0.journal.gz"
+    _write(journal, path)
+    os.truncate(path, os.path.getsize(path) - 20)
+    reader = journal.JournalReader(str(path))
+    records = list(reader)
+    assert reader.truncated
+    assert (BATCHES - 1) * RECORDS <= len(records) < BATCHES * RECORDS
+    assert reader.records == len(records)
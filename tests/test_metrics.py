@@ -0,0 +1,31 @@
+"""Gas flow derived from the meter reading."""
+
+FRAME_INTERVAL = 5
+RATE = 1.8  # m³/h
+
+
+def _values(telemetry, gas, flame):
+    """Return a telemetry record with a gas reading and flame state."""
+    record = telemetry.Telemetry({"crt": 20, "gas": gas, "fst": flame, "ccm": flame, "cdm": 0})
+    return record.values
+
+
+def test_flow_after_idle_period(telemetry, metrics):
+    """The first meter step after a long idle period is not spread over it."""
+    derived = metrics.DerivedMetrics()
+    now, gas = 1000.0, 100.0
+    # 熄火一小时
+    for _ in range(3600 // FRAME_INTERVAL):
+        derived.update(now, _values(telemetry, round(gas, 3), 0))
+        now += FRAME_INTERVAL
+    assert derived.gas_flow == 0.0
+    # 以 1.8 m³/h 燃烧，表计分辨率 0.001 m³
+    flows = []
+    for _ in range(120 // FRAME_INTERVAL):
+        gas += RATE * FRAME_INTERVAL / 3600
+        derived.update(now, _values(telemetry, round(gas, 3), 1))
+        flows.append(derived.gas_flow)
+        now += FRAME_INTERVAL
+    first = next(flow for flow in flows if flow)
+    assert abs(first - RATE) < 0.3 * RATE
+    assert derived.gas_flow_avg > 0.2 * RATE
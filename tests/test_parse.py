@@ -0,0 +1,92 @@
+"""Routing and throughput of the parse pipeline on a shared multicast group."""
+
+import json
+import time
+
+from test_codec import unpack_data
+
+SECRET = "12345678"
+SERIAL = "abc123"
+BENCH_ROUNDS = 5000
+
+
+def _mixed_frames(codec):
+    """Return one round of own, foreign, other-secret and corrupt frames."""
+    own = codec.AirtubCodec(SECRET)
+    other = codec.AirtubCodec("87654321")
+
+    def frame(airtub, message):
+        return airtub.pack(1, json.dumps(message, separators=(",", ":")).encode("ascii"))
+
+    report = {"crt": 21.5, "trt": 22, "cct": 48, "mod": 35, "fst": 1, "gas": 123.456}
+    corrupt = bytearray(frame(own, {"dev": SERIAL, **report}))
+    corrupt[4] ^= 0x01
+    return [
+        frame(own, {"dev": SERIAL, **report}),
+        frame(own, {"dev": "def456", **report}),
+        frame(other, {"dev": "fed654", **report}),
+        bytes(corrupt),
+    ]
+
+
+def _original_parse(data):
+    """Parse a frame as the original listener did, return the data dict or None."""
+    _, _, realdata, crc1, crc2 = unpack_data(data, SECRET)
+    if crc1 == crc2 and SERIAL in realdata.decode("ascii", errors="ignore"):
+        data_content = realdata.decode("ascii", errors="ignore").replace(f'"dev":"{SERIAL}",', "")
+        data_dict = json.loads(data_content)
+        data_dict.setdefault("mod", 0)
+        data_dict.setdefault("flt", 0)
+        data_dict.setdefault("pwr", 0)
+        data_dict.setdefault("sch", 0)
+        data_dict.setdefault("tmd", 0)
+        data_dict.setdefault("tol", 4)
+        if "gas" in data_dict and data_dict["gas"] == 0:
+            data_dict["gas"] = 0.000001
+        return data_dict
+    return None
+
+
+def _parser(codec, telemetry):
+    """Return a parse function following AirtubListener.datagram_received."""
+    airtub = codec.AirtubCodec(SECRET)
+    record = telemetry.Telemetry()
+
+    def parse(data):
+        message = airtub.decode(data)
+        if message is None:
+            return None
+        if message.pop("dev", None) != SERIAL:
+            return None
+        record.update(message)
+        return record
+
+    return parse
+
+
+def test_routes_only_own_frames(codec, telemetry):
+    """Foreign, other-secret and corrupt frames are rejected."""
+    parse = _parser(codec, telemetry)
+    results = [parse(data) for data in _mixed_frames(codec)]
+    assert results[0] is not None and results[0].get("crt") == 21.5
+    assert results[1:] == [None, None, None]
+    assert [_original_parse(data) is not None for data in _mixed_frames(codec)] == [
+        True, False, False, False
+    ]
+
+
+def test_mixed_traffic_throughput(codec, telemetry):
+    """Compare the original parse with the decode-once pipeline on mixed traffic."""
+    frames = _mixed_frames(codec) * BENCH_ROUNDS
+    parse = _parser(codec, telemetry)
+    timings = {}
+    for name, function in (("before", _original_parse), ("after", parse)):
+        started = time.perf_counter()
+        for data in frames:
+            function(data)
+        timings[name] = len(frames) / (time.perf_counter() - started)
+    print(
+        f"\nmixed traffic: {timings['before']:,.0f} frames/s before, "
+        f"{timings['after']:,.0f} frames/s after"
+    )
+    assert timings["after"] > timings["before"]
@@ -0,0 +1,71 @@
+"""Steady-state allocations of the receive path."""
+
+import json
+import socket
+import tracemalloc
+
+SECRET = "12345678"
+SERIAL = "abc123"
+BATCH = 200
+BATCHES = 5
+# 同一时刻只应存在一帧的临时对象（解码出的 JSON 对象等）与一轮读取的通知
+MAX_PEAK_PER_BATCH = 8192
+MAX_RETAINED_PER_FRAME = 8
+
+
+def _frames(codec):
+    """Return a batch of full frames with changing values."""
+    airtub = codec.AirtubCodec(SECRET)
+    return [
+        airtub.pack(
+            1,
+            json.dumps(
+                {"dev": SERIAL, "crt": 20 + i % 30 / 10, "mod": i % 100, "gas": 100 + i / 1000},
+                separators=(",", ":"),
+            ).encode("ascii"),
+        )
+        for i in range(BATCH)
+    ]
+
+
+def test_receive_path_allocations_are_bounded(codec, hub, hass):
+    """AirtubListener._read_ready retains nothing per frame.
+
+    The frames go through the whole listener: recvfrom_into, the duplicate
+    check, decoding, AirtubDevice.async_process with its history and derived
+    metrics, and the notification of the entities at the end of each drain.
+    """
+    listener = hub.AirtubListener(hass, "127.0.0.1", multicast=False)
+    device = hub.AirtubDevice(hass, SERIAL, SECRET, "unicast", 0.1, lambda: None)
+    listener.add(device)
+    receiver = hub._create_socket("127.0.0.1", 0)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    listener._sock = receiver
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = receiver.getsockname()
+    frames = _frames(codec)
+
+    def receive_batch():
+        for data in frames:
+            sender.sendto(data, address)
+        expected = listener.stats.frames + BATCH
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        while listener.stats.frames < expected:
+            listener._read_ready()
+        current, peak = tracemalloc.get_traced_memory()
+        return current - before, peak - before
+
+    tracemalloc.start()
+    try:
+        receive_batch()  # 预热：首次出现的键与缓存
+        results = [receive_batch() for _ in range(BATCHES)]
+    finally:
+        tracemalloc.stop()
+        listener.close()
+        sender.close()
+
+    assert device.stats.frames == BATCH * (BATCHES + 1)
+    for retained, peak in results:
+        assert retained <= MAX_RETAINED_PER_FRAME * BATCH
+        assert peak <= MAX_PEAK_PER_BATCH
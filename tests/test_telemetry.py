@@ -0,0 +1,28 @@
+"""Change detection and idle defaults of the telemetry record."""
+
+FULL = {"crt": 20.0, "trt": 21, "mod": 55, "flt": 3, "pwr": 2, "tol": 6, "gas": 12.5}
+
+
+def test_partial_frame_updates_only_its_keys(telemetry):
+    """An ack such as {"trt": 22} must not reset mod/flt/pwr/tol."""
+    record = telemetry.Telemetry(FULL)
+    assert record.update({"trt": 22}) == ["trt"]
+    assert record.get("mod") == 55
+    assert record.get("flt") == 3
+
+
+def test_full_frame_resets_omitted_keys(telemetry):
+    """A full frame that leaves out an idle key resets it to its default."""
+    record = telemetry.Telemetry(FULL)
+    changed = record.update({"crt": 20.0, "trt": 21, "gas": 12.5})
+    assert sorted(changed) == ["flt", "mod", "pwr", "tol"]
+    assert record.get("mod") == 0
+    assert record.get("tol") == 4
+
+
+def test_gas_zero_and_unchanged_values(telemetry):
+    """A zero meter reading is replaced and unchanged values are not reported."""
+    record = telemetry.Telemetry(FULL)
+    assert record.update(dict(FULL)) == []
+    assert record.update({**FULL, "gas": 0}) == ["gas"]
+    assert record.get("gas") == telemetry.GAS_MIN
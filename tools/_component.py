@@ -0,0 +1,25 @@
+"""Import the Home Assistant independent modules of the integration.
+
+The component directory is registered as a bare airtub_udp package, so the
+modules' relative imports resolve while its __init__.py, which needs Home
+Assistant, is never run. Used by the tools and the tests.
+"""
+
+import importlib
+import os
+import sys
+import types
+
+COMPONENT_DIR = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "custom_components", "airtub_udp")
+)
+PACKAGE = "airtub_udp"
+
+
+def load(name: str):
+    """Import a module of the integration, e.g. load("codec")."""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [COMPONENT_DIR]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.{name}")
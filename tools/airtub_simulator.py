@@ -0,0 +1,283 @@
+"""Simulate Airtub Partners on the local network for load and latency tests.
+
+Usage:
+    python tools/airtub_simulator.py --secret SECRET [--devices N] [--rate HZ]
+        [--mode multicast|unicast] [--target HOST] [--bind ADDRESS]
+        [--loss P] [--duplicate P] [--reorder P] [--corrupt P]
+        [--duration SECONDS] [--seed N]
+
+Every virtual device reports a simple boiler model (room and flow water
+temperature, flame, modulation and a gas meter) in the integration's wire
+format, and answers commands with a frame carrying "rec" and the new values.
+The devices share one socket bound to ADDRESS on the Airtub port, so the
+integration sends its commands there. Serials are sim000, sim001, ...
+
+Unicast, on the same host as Home Assistant: configure the devices with
+transport unicast and host 127.0.0.2 (the default --bind), then run
+    python tools/airtub_simulator.py --secret SECRET --mode unicast
+
+Multicast: --bind defaults to the address of the interface that carries the
+group. A "ser" command switches a device between multicast and unicast as the
+real Partner does.
+
+The impairments apply to every outgoing frame, acks included. --reorder holds
+a frame back and sends it after the next one of the same device. --corrupt
+flips a CRC bit.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import sys
+import time
+from collections import Counter
+
+from _component import load
+
+codec = load("codec")
+telemetry_module = load("telemetry")
+
+UDP_GROUP = "224.0.1.3"
+UDP_PORT = 4211
+TELEMETRY_MSG_TYPE = 1
+# 命令中不属于设备状态的字段
+COMMAND_META = frozenset(("tar", "dev", "pwr", "try"))
+# 简化的锅炉模型参数
+GAS_FULL_LOAD = 2.5  # m³/h
+ROOM_HYSTERESIS = 0.3
+DHW_DEMAND_CHANCE = 0.002
+
+
+class VirtualBoiler:
+    """Boiler model behind one virtual Airtub Partner."""
+
+    def __init__(self, serial: str, rng: random.Random):
+        """Initialize the model."""
+        self.serial = serial
+        self.rng = rng
+        self.state = {
+            "sch": 0, "loc": 0, "tmd": 0, "tol": 4, "tcm": 0, "tct": 60,
+            "tdm": 1, "tdt": 45, "atm": 1, "trt": 21.0,
+            "crt": round(rng.uniform(18.0, 22.0), 1), "pwr": 0, "odt": rng.randint(-5, 15),
+            "coe": 0, "ccm": 0, "cct": 30, "cdm": 0, "cdt": 40, "fst": 0, "ovr": 0,
+            "mod": 0, "flt": 0, "gas": round(rng.uniform(100, 5000), 3),
+        }
+
+    def step(self, elapsed: float):
+        """Advance the model by elapsed seconds."""
+        state = self.state
+        heating = state["atm"] or state["tcm"]
+        if state["cdm"]:
+            state["cdm"] = int(self.rng.random() > 0.05)
+        elif state["tdm"] and self.rng.random() < DHW_DEMAND_CHANCE:
+            state["cdm"] = 1
+        if state["crt"] < state["trt"] - ROOM_HYSTERESIS:
+            state["ccm"] = int(bool(heating))
+        elif state["crt"] > state["trt"] + ROOM_HYSTERESIS:
+            state["ccm"] = 0
+        flame = state["ccm"] or state["cdm"]
+        state["fst"] = int(bool(flame))
+        if flame:
+            state["mod"] = max(10, min(100, state["mod"] + self.rng.randint(-5, 8)))
+            state["cct"] = min(state["tct"], state["cct"] + 1)
+            state["gas"] = round(state["gas"] + GAS_FULL_LOAD * state["mod"] / 100 * elapsed / 3600, 3)
+        else:
+            state["mod"] = 0
+            state["cct"] = max(30, state["cct"] - 1)
+        drift = 0.02 if state["ccm"] else -0.01
+        state["crt"] = round(state["crt"] + drift * elapsed + self.rng.uniform(-0.05, 0.05), 1)
+        state["cdt"] = state["tdt"] if state["cdm"] else max(35, state["cdt"] - 1)
+
+    def report(self) -> dict:
+        """Return the frame content, leaving out keys at their idle value."""
+        defaults = telemetry_module.FRAME_DEFAULTS
+        return {
+            key: value for key, value in self.state.items() if defaults.get(key) != value
+        }
+
+    def apply(self, command: dict) -> dict:
+        """Apply a command and return the keys it changed."""
+        changed = {}
+        for key, value in command.items():
+            if key not in COMMAND_META and key != "ser":
+                self.state[key] = value
+                changed[key] = value
+        return changed
+
+
+class Simulator(asyncio.DatagramProtocol):
+    """Send the frames of every virtual device and answer their commands."""
+
+    def __init__(self, args, rng: random.Random):
+        """Initialize the simulator."""
+        self.args = args
+        self.rng = rng
+        self.codec = codec.AirtubCodec(args.secret)
+        self.devices = {
+            f"sim{index:03}": VirtualBoiler(f"sim{index:03}", rng) for index in range(args.devices)
+        }
+        default = (UDP_GROUP, UDP_PORT) if args.mode == "multicast" else (args.target, UDP_PORT)
+        self.destinations = dict.fromkeys(self.devices, default)
+        self.held = {}
+        self.stats = Counter()
+        self.transport = None
+
+    def connection_made(self, transport):
+        """Keep the transport."""
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        """Apply a command and acknowledge it."""
+        self.stats["commands"] += 1
+        message = self.codec.decode(data)
+        if message is None:
+            self.stats["bad_commands"] += 1
+            return
+        serial = message.get("tar")
+        device = self.devices.get(serial.lower()) if isinstance(serial, str) else None
+        if device is None:
+            self.stats["foreign_commands"] += 1
+            return
+        if message.get("try"):
+            self.stats["command_retries"] += 1
+        target = message.get("ser")
+        if isinstance(target, str):
+            # "0.0.0.0" 恢复组播，其它地址改为点对点发送
+            self.destinations[device.serial] = (
+                (UDP_GROUP, UDP_PORT) if target == "0.0.0.0" else (target, UDP_PORT)
+            )
+        ack = {"dev": device.serial, "rec": 1, **device.apply(message)}
+        self.stats["acks"] += 1
+        self.send(device.serial, ack)
+
+    def error_received(self, exc):
+        """Count socket errors, e.g. ICMP port unreachable."""
+        self.stats["socket_errors"] += 1
+
+    def send(self, serial: str, message: dict):
+        """Encode a frame and send it through the impairments."""
+        payload = json.dumps(message, separators=(",", ":")).encode("ascii")
+        data = bytearray(self.codec.pack(TELEMETRY_MSG_TYPE, payload))
+        args = self.args
+        rng = self.rng
+        if rng.random() < args.loss:
+            self.stats["lost"] += 1
+            return
+        if rng.random() < args.corrupt:
+            data[4] ^= 0x01  # CRC 的第一个字节
+            self.stats["corrupted"] += 1
+        destination = self.destinations[serial]
+        if rng.random() < args.reorder and serial not in self.held:
+            self.held[serial] = bytes(data)
+            self.stats["reordered"] += 1
+            return
+        self.transport.sendto(data, destination)
+        self.stats["sent"] += 1
+        if rng.random() < args.duplicate:
+            self.transport.sendto(data, destination)
+            self.stats["duplicated"] += 1
+        held = self.held.pop(serial, None)
+        if held is not None:
+            self.transport.sendto(held, destination)
+            self.stats["sent"] += 1
+
+    async def run_device(self, device: VirtualBoiler):
+        """Report one device at the configured rate."""
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.args.rate
+        # 错开各设备的发送时间
+        deadline = loop.time() + self.rng.uniform(0, interval)
+        while True:
+            await asyncio.sleep(max(0.0, deadline - loop.time()))
+            device.step(interval)
+            for frame in _split(device.serial, device.report()):
+                self.send(device.serial, frame)
+            deadline += interval
+
+
+def _split(serial: str, state: dict):
+    """Split a report into frames whose payload fits in MAX_PAYLOAD bytes."""
+    frame = {"dev": serial}
+    for key, value in state.items():
+        frame[key] = value
+        if len(json.dumps(frame, separators=(",", ":"))) > codec.MAX_PAYLOAD:
+            del frame[key]
+            yield frame
+            frame = {"dev": serial, key: value}
+    yield frame
+
+
+def _multicast_address() -> str:
+    """Return the local address the multicast group is routed through."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+        probe.connect((UDP_GROUP, UDP_PORT))
+        return probe.getsockname()[0]
+
+
+def _create_socket(args):
+    """Create the socket shared by the virtual devices."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.bind, UDP_PORT))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(args.bind))
+    sock.setblocking(False)
+    return sock
+
+
+async def simulate(args):
+    """Run the simulator until the duration elapses."""
+    rng = random.Random(args.seed)
+    loop = asyncio.get_running_loop()
+    simulator = Simulator(args, rng)
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: simulator, sock=_create_socket(args)
+    )
+    tasks = [asyncio.create_task(simulator.run_device(device)) for device in simulator.devices.values()]
+    started = time.monotonic()
+    try:
+        while args.duration is None or time.monotonic() - started < args.duration:
+            await asyncio.sleep(args.report)
+            elapsed = time.monotonic() - started
+            print(
+                f"{elapsed:7.1f} s  {simulator.stats['sent'] / elapsed:8.1f} frames/s  "
+                + "  ".join(f"{name}={count}" for name, count in sorted(simulator.stats.items())),
+                flush=True,
+            )
+    finally:
+        for task in tasks:
+            task.cancel()
+        transport.close()
+    return simulator.stats
+
+
+def main():
+    """Run the simulator tool."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--secret", required=True, help="device password configured in Home Assistant")
+    parser.add_argument("--devices", type=int, default=1, help="number of virtual devices")
+    parser.add_argument("--rate", type=float, default=1.0, help="frames per second per device")
+    parser.add_argument("--mode", choices=["multicast", "unicast"], default="multicast")
+    parser.add_argument("--target", default="127.0.0.1", help="Home Assistant address in unicast mode")
+    parser.add_argument("--bind", help="local address of the devices")
+    parser.add_argument("--loss", type=float, default=0.0, help="probability a frame is dropped")
+    parser.add_argument("--duplicate", type=float, default=0.0, help="probability a frame is sent twice")
+    parser.add_argument("--reorder", type=float, default=0.0, help="probability a frame is delayed")
+    parser.add_argument("--corrupt", type=float, default=0.0, help="probability of a bad CRC")
+    parser.add_argument("--duration", type=float, help="seconds to run, forever when omitted")
+    parser.add_argument("--report", type=float, default=5.0, help="seconds between statistics lines")
+    parser.add_argument("--seed", type=int, help="random seed for a repeatable run")
+    args = parser.parse_args()
+    if args.bind is None:
+        args.bind = _multicast_address() if args.mode == "multicast" else "127.0.0.2"
+    try:
+        asyncio.run(simulate(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Replay an Airtub raw frame journal through the integration's decode path.
+
+Usage:
+    python tools/replay_journal.py JOURNAL [JOURNAL ...] --secret SECRET
+        [--device SERIAL] [--speed max|realtime] [--verbose]
+
+Journals are written to <config>/airtub_udp_journal/ when "Record raw frames
+to a journal" is enabled in the integration options. Rotated files
+(*.journal.gz.1, ...) can be passed too, oldest first.
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+
+from _component import load
+
+codec = load("codec")
+journal = load("journal")
+telemetry_module = load("telemetry")
+
+
+def replay(paths, secret, device=None, realtime=False, verbose=False):
+    """Replay journals and return the statistics."""
+    airtub = codec.AirtubCodec(secret)
+    stats = Counter()
+    devices = Counter()
+    unknown_keys = Counter()
+    records = {}
+    decode_time = 0.0
+    first_wall = first_frame = None
+
+    for path in paths:
+        reader = journal.JournalReader(path)
+        for timestamp, addr, data in reader:
+            if realtime:
+                if first_wall is None:
+                    first_wall, first_frame = time.monotonic(), timestamp
+                delay = (timestamp - first_frame) - (time.monotonic() - first_wall)
+                if delay > 0:
+                    time.sleep(delay)
+
+            stats["frames"] += 1
+            started = time.perf_counter()
+            message = airtub.decode(data)
+            dev = message.pop("dev", None) if message is not None else None
+            telemetry = None
+            if isinstance(dev, str) and (device is None or dev.lower() == device):
+                message.pop("rec", None)
+                telemetry = records.get(dev.lower())
+                if telemetry is None:
+                    telemetry = records[dev.lower()] = telemetry_module.Telemetry()
+                telemetry.update(message)
+            decode_time += time.perf_counter() - started
+
+            if message is None:
+                # 区分 CRC 错误与其它密钥加密的数据
+                stats["crc_errors" if airtub.unpack(data) is None else "undecodable"] += 1
+                if verbose:
+                    print(f"{timestamp:.3f} {addr[0]} rejected {data.hex()}")
+                continue
+            if telemetry is None:
+                stats["foreign"] += 1
+                continue
+            stats["decoded"] += 1
+            devices[dev.lower()] += 1
+            # 集成未知的数据键单独统计
+            unknown_keys.update(key for key in message if key not in telemetry_module.FIELD_INDEX)
+            if verbose:
+                print(f"{timestamp:.3f} {addr[0]} {json.dumps(message, separators=(',', ':'))}")
+        if reader.truncated:
+            # 通常是 HA 在写入时被停止，之前的完整记录仍然有效
+            stats["truncated"] += 1
+            print(f"{path}: truncated after {reader.records} records", file=sys.stderr)
+
+    return stats, devices, unknown_keys, decode_time
+
+
+def main():
+    """Run the replay tool."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("journals", nargs="+", help="journal files, oldest first")
+    parser.add_argument("--secret", required=True, help="device password")
+    parser.add_argument("--device", help="only decode frames of this serial")
+    parser.add_argument("--speed", choices=["max", "realtime"], default="max")
+    parser.add_argument("--verbose", action="store_true", help="print every frame")
+    args = parser.parse_args()
+
+    stats, devices, unknown_keys, decode_time = replay(
+        args.journals,
+        args.secret,
+        args.device.lower() if args.device else None,
+        args.speed == "realtime",
+        args.verbose,
+    )
+    frames = stats["frames"]
+    print(f"frames:       {frames}")
+    for name in ("decoded", "foreign", "crc_errors", "undecodable", "truncated"):
+        print(f"{name + ':':<14}{stats[name]}")
+    for serial, count in devices.most_common():
+        print(f"device {serial}: {count}")
+    for key, count in unknown_keys.most_common():
+        print(f"unknown key {key}: {count}")
+    if frames:
+        print(f"decode time:  {decode_time * 1e6 / frames:.2f} us/frame")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())